@@ -0,0 +1,107 @@
+"""
+Бенчмарк форматов значений кеша API: размер значения и время чтения до готового JSON-ответа.
+
+Сравнивает прежний формат (JSON-массив JSON-строк, который разбирался в pydantic-модели и сериализовался
+заново) с кодеками CacheCodec на синтетических персонах с длинной фильмографией и страницах списка фильмов.
+С --redis дополнительно кладёт значения в Redis и показывает MEMORY USAGE ключа. Запуск из корня проекта:
+
+    python benchmarks/cache_codec.py --films 300 --redis redis://localhost:6379
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import uuid
+
+import orjson
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('REDIS_HOST', 'localhost')
+os.environ.setdefault('ES_HOST', 'localhost')
+
+from src.models.film import FilmPreview  # noqa: E402
+from src.models.persons import Person  # noqa: E402
+from src.services.codec import CacheCodec  # noqa: E402
+from src.services.pagination import pack_page, unpack_page  # noqa: E402
+
+CODECS = {
+    'json': ('json', 'none'),
+    'json+lz4': ('json', 'lz4'),
+    'json+zstd': ('json', 'zstd'),
+    'msgpack': ('msgpack', 'none'),
+    'msgpack+zstd': ('msgpack', 'zstd'),
+}
+
+
+def make_persons(count: int, films: int) -> list[dict]:
+    return [{
+        'person_id': str(uuid.uuid4()),
+        'full_name': f'Person {i}',
+        'films': [{'id': str(uuid.uuid4()), 'roles': ['actor', 'writer'][:1 + j % 2]} for j in range(films)],
+    } for i in range(count)]
+
+
+def make_films(count: int) -> list[dict]:
+    return [{'id': str(uuid.uuid4()), 'title': f'Film title {i}', 'imdb_rating': round(i % 100 / 10, 1)}
+            for i in range(count)]
+
+
+def legacy_encode(model, items: list[dict]) -> bytes:
+    return orjson.dumps([model(**item).json() for item in items])
+
+
+def legacy_decode(model, value: bytes) -> bytes:
+    items = [model.parse_raw(item) for item in orjson.loads(value)]
+    return orjson.dumps([item.model_dump() for item in items])
+
+
+def measure(decode, value: bytes, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        decode(value)
+        timings.append((time.perf_counter() - started) * 1_000_000)
+    return statistics.median(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--films', type=int, default=300, help='Фильмов в фильмографии персоны')
+    parser.add_argument('--page-size', type=int, default=50, help='Фильмов на странице списка')
+    parser.add_argument('--threshold', type=int, default=1024, help='CACHE_COMPRESSION_THRESHOLD')
+    parser.add_argument('--repeat', type=int, default=2000)
+    parser.add_argument('--redis', help='URL Redis для замера MEMORY USAGE')
+    args = parser.parse_args()
+
+    redis = None
+    if args.redis:
+        from redis import Redis
+        redis = Redis.from_url(args.redis)
+
+    cases = {
+        'persons page': (Person, make_persons(10, args.films)),
+        'films page': (FilmPreview, make_films(args.page_size)),
+    }
+    for title, (model, items) in cases.items():
+        body = orjson.dumps(items)
+        values = {'legacy': (legacy_encode(model, items), lambda value, m=model: legacy_decode(m, value))}
+        for name, (data_format, compression) in CODECS.items():
+            codec = CacheCodec(data_format, compression, args.threshold)
+            values[name] = (codec.encode(pack_page(body, None), 300),
+                            lambda value, c=codec: unpack_page(c.decode(value)[0]))
+
+        print(f'\n{title}: {len(items)} items, response {len(body)} bytes')
+        print(f'{"format":<16}{"value, B":>10}{"redis, B":>10}{"decode, us":>12}')
+        for name, (value, decode) in values.items():
+            memory = '-'
+            if redis:
+                redis.set('bench:cache_codec', value)
+                memory = redis.memory_usage('bench:cache_codec')
+            print(f'{name:<16}{len(value):>10}{memory:>10}{measure(decode, value, args.repeat):>12.1f}')
+    if redis:
+        redis.delete('bench:cache_codec')
+
+
+if __name__ == '__main__':
+    main()
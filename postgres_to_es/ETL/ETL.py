@@ -1,6 +1,12 @@
-from extractor import DBConnectionError, PsExtractor
-from loader import ESConnectionError, ESLoader
-from settings.settings import db_settings, es_settings, logger
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Set
+
+from extractor import DBConnectionError, PartialUpdates, PsExtractor, RawDocuments
+from hash_index import HashIndex
+from loader import ESBulkError, ESConnectionError, ESLoader
+from publisher import ChangePublisher, PublishError
+from settings.settings import db_settings, es_settings, etl_settings, logger, redis_settings
 from state import State
 from transformer import DataTransformer
 
@@ -8,27 +14,254 @@ from transformer import DataTransformer
 class ETL:
 
     def __init__(self, state: State) -> None:
-        self.extractor = PsExtractor(db_settings)
-        self.transformer = DataTransformer()
-        self.loader = ESLoader(es_settings)
+        self.extractor = PsExtractor(db_settings, etl_settings.itersize, etl_settings.partial_updates)
+        self.transformer = DataTransformer(etl_settings.transform_workers)
+        self.publisher = ChangePublisher(redis_settings)
+        self.hash_index = HashIndex(etl_settings.hash_index_path) if etl_settings.skip_unchanged else None
+        self.loader = ESLoader(es_settings, etl_settings, self.publisher)
         self.state = state
+        # Когда последний раз повторялась загрузка отклонённых документов индекса
+        self.rejected_retried_at: Dict[str, float] = {}
 
     def start(self) -> None:
         """
         ETL: extract + transform + load
+
+        Сначала одним дешёвым запросом проверяется, есть ли изменения, и обрабатываются только индексы,
+        у которых они есть или пора повторить загрузку отклонённых документов. Индексы обрабатываются
+        одновременно, каждый в своём потоке.
         """
-        state = self.state.get_state()
-        if state:
-            logger.info(f'ETL started with state: modified at = {state}')
-        else:
-            logger.info(f'ETL started first time')
+        watermarks = {data_type: self.state.get_state(data_type) for data_type in self.extractor.query.keys()}
         try:
-            data = self.extractor.extract(state)
-            transformed_data = self.transformer.transform(data)
-            self.loader.load(transformed_data)
-            self.state.set_state()
-        except (DBConnectionError, ESConnectionError) as error:
+            changed = self.extractor.get_changed_indexes(watermarks)
+        except DBConnectionError as error:
             logger.error(f'Complete ETLProcess with error: {error}')
-        except Exception as error:
-            logger.exception(f'ETL finished with error: {error}')
+            return
+        changed += [data_type for data_type in watermarks if data_type not in changed and self.rejected_due(data_type)]
+        if not changed:
+            return
+        with ThreadPoolExecutor(max_workers=len(changed)) as executor:
+            for data_type in changed:
+                executor.submit(self.process, data_type)
+        logger.info('Done')
+
+    def apply_changes(self, changes: Dict[str, List[str]]) -> None:
+        """
+        ETL только для документов, затронутых строками с известными id (из LISTEN/NOTIFY).
+
+        Водяные знаки не сдвигаются: их продолжает вести резервный опрос изменений.
+
+        :param changes: id изменённых строк по таблицам: film_work, person, genre.
+        """
+        affected = [
+            data_type for data_type, sources in self.extractor.sources.items()
+            if any(changes.get(source) for source in sources)
+        ]
+        if not affected:
+            return
+        logger.info(f'Reindex {affected} for changes: { {table: len(ids) for table, ids in changes.items()} }')
+        with ThreadPoolExecutor(max_workers=len(affected)) as executor:
+            for data_type in affected:
+                executor.submit(self.process_changes, data_type, changes)
         logger.info('Done')
+
+    def process_changes(self, data_type: str, changes: Dict[str, List[str]]) -> None:
+        """ETL одного индекса по id изменённых строк."""
+        try:
+            for rows in self.extractor.extract_by_ids(data_type, changes):
+                if rows:
+                    self.load(data_type, rows)
+        except (DBConnectionError, ESConnectionError, ESBulkError, PublishError) as error:
+            logger.error(f'Complete ETLProcess for {data_type} with error: {error}')
+        except Exception as error:
+            logger.exception(f'ETL for {data_type} finished with error: {error}')
+
+    def load(
+            self, data_type: str, rows: List[Dict] | PartialUpdates | RawDocuments, target: str | None = None,
+            full: bool = False,
+    ) -> Set[str]:
+        """
+        Преобразует пачку строк и загружает получившиеся документы.
+
+        Документы, которые получились такими же, как в прошлый раз, не отправляются. Хеши сохраняются
+        только после загрузки, поэтому после сбоя документ будет отправлен снова. При загрузке в новую
+        версию индекса хеши не используются: в ней должны оказаться все документы. При полной загрузке
+        (состояние сброшено) отправляются все документы, а их хеши сохраняются заново, и загрузка
+        не ждёт refresh индекса перед публикацией id. Перед сравнением хеши сверяются с индексом,
+        который сейчас стоит за алиасом: хеши удалённого или перестроенного индекса сбрасываются.
+
+        Частичные обновления и документы, собранные в Postgres, отправляются всегда,
+        а хеши отправленных документов забываются.
+
+        id документов, отклонённых Elasticsearch, сохраняются в состоянии до того, как водяной знак
+        уйдёт дальше них, и их загрузка потом повторяется.
+
+        :param data_type: Название индекса.
+        :param rows: Пачка строк из Postgres.
+        :param target: Версия индекса, в которую пишутся документы.
+        :param full: Пачка полной загрузки, а не инкрементальной.
+        :return: id документов, отклонённых Elasticsearch.
+        """
+        if isinstance(rows, (PartialUpdates, RawDocuments)):
+            if isinstance(rows, PartialUpdates):
+                actions = self.transformer.transform_updates(rows)
+            else:
+                actions = self.transformer.transform_sources(rows)
+            rejected = self.loader.load(data_type, actions, target, full)
+            if self.hash_index and not target:
+                self.hash_index.delete(data_type, [action['_id'] for action in actions])
+            return self.reject(data_type, rejected)
+        actions = self.transformer.transform(data_type, rows)
+        if target or not self.hash_index:
+            return self.reject(data_type, self.loader.load(data_type, actions, target, full))
+        if self.hash_index.bind(data_type, self.loader.get_uuid(data_type)):
+            logger.info(f'Stored document hashes of {data_type} belong to another index, reset them')
+        hashes = {action['_id']: HashIndex.get_hash(action['_source']) for action in actions}
+        changed = hashes if full else self.hash_index.get_changed(data_type, hashes)
+        if len(changed) < len(actions):
+            logger.info(f'Skip {len(actions) - len(changed)} unchanged documents of {data_type}')
+            actions = [action for action in actions if action['_id'] in changed]
+        if not actions:
+            return set()
+        rejected = self.loader.load(data_type, actions, full=full)
+        self.hash_index.save(data_type, {doc_id: doc_hash for doc_id, doc_hash in changed.items()
+                                         if doc_id not in rejected})
+        return self.reject(data_type, rejected)
+
+    def reject(self, data_type: str, rejected: Set[str]) -> Set[str]:
+        """Сохраняет id отклонённых документов индекса; повтор будет не раньше ETL_REJECTED_RETRY_INTERVAL."""
+        if rejected:
+            self.state.add_rejected(data_type, rejected)
+            self.rejected_retried_at.setdefault(data_type, time.monotonic())
+        return rejected
+
+    def rejected_due(self, data_type: str) -> bool:
+        """Есть ли у индекса отклонённые документы, загрузку которых пора повторить."""
+        retried_at = self.rejected_retried_at.get(data_type)
+        return bool(self.state.get_rejected(data_type)) and (
+            retried_at is None or time.monotonic() - retried_at >= etl_settings.rejected_retry_interval
+        )
+
+    def retry_rejected(self, data_type: str) -> None:
+        """
+        Повторяет загрузку документов, которые Elasticsearch отклонил раньше.
+
+        Документы собираются заново по id строк. Загруженные документы и документы, строк которых
+        больше нет, забываются, а снова отклонённые остаются в списке.
+        """
+        if not self.rejected_due(data_type):
+            return
+        ids = self.state.get_rejected(data_type)
+        self.rejected_retried_at[data_type] = time.monotonic()
+        logger.info(f'Retry {len(ids)} rejected documents of {data_type}')
+        rejected = set()
+        for rows in self.extractor.extract_by_ids(data_type, {self.extractor.document_source[data_type]: ids}):
+            if rows:
+                rejected |= self.load(data_type, rows)
+        self.state.discard_rejected(data_type, set(ids) - rejected)
+
+    def close(self) -> None:
+        """Закрывает соединения с Postgres, Elasticsearch и Redis."""
+        self.extractor.close()
+        self.loader.close()
+        self.publisher.close()
+        self.transformer.close()
+        if self.hash_index:
+            self.hash_index.close()
+
+    def process(self, data_type: str) -> None:
+        """
+        ETL одного индекса.
+
+        Данные проходят через конвейер пачками: каждая пачка строк из Postgres сразу
+        преобразуется и загружается в Elastic, поэтому расход памяти не зависит от размера таблиц.
+        После загрузки пачки водяной знак индекса сдвигается, если экстрактор отдал его вместе с пачкой.
+        """
+        watermark = self.state.get_state(data_type)
+        if watermark:
+            logger.info(f'ETL started for {data_type} with state: {watermark}')
+        else:
+            logger.info(f'ETL started first time for {data_type}')
+        full = watermark is None
+        try:
+            self.retry_rejected(data_type)
+            for rows, watermark in self.extractor.extract(data_type, watermark):
+                if rows:
+                    self.load(data_type, rows, full=full)
+                if watermark:
+                    self.state.set_state(data_type, watermark)
+        except (DBConnectionError, ESConnectionError, ESBulkError, PublishError) as error:
+            logger.error(f'Complete ETLProcess for {data_type} with error: {error}')
+        except Exception as error:
+            logger.exception(f'ETL for {data_type} finished with error: {error}')
+
+    def reindex(self, data_type: str) -> bool:
+        """
+        Полная переиндексация без простоя (blue/green).
+
+        Все документы загружаются в новую версию индекса, которую API пока не читает. Затем версия
+        догоняет изменения, сделанные за время загрузки, готовится к поиску и получает алиас индекса.
+        Изменения, успевшие попасть в старую версию между последним догоном и переключением,
+        загружаются ещё раз уже через алиас. Водяные знаки основного процесса ETL не трогаются.
+
+        Если загрузка не удалась до переключения алиаса, новая версия удаляется. После переключения
+        версию уже читает API, поэтому она остаётся, даже если последний догон не удался.
+
+        :param data_type: Название индекса.
+        :return: True, если алиас переключён на новую версию.
+        """
+        target = None
+        swapped = False
+        try:
+            target = self.loader.create_version(data_type)
+            watermark = self.load_all(data_type, None, target)
+            logger.info(f'Reindex {data_type}: loaded into {target}, catching up')
+            watermark = self.load_all(data_type, watermark, target)
+            self.loader.optimize_version(data_type, target)
+            watermark = self.load_all(data_type, watermark, target)
+            self.loader.swap_alias(data_type, target)
+            swapped = True
+            self.load_all(data_type, watermark)
+        except (DBConnectionError, ESConnectionError, ESBulkError, PublishError) as error:
+            logger.error(f'Reindex for {data_type} finished with error: {error}')
+        except Exception as error:
+            logger.exception(f'Reindex for {data_type} finished with error: {error}')
+        else:
+            logger.info(f'Reindex {data_type} done')
+            return True
+        if swapped:
+            logger.error(
+                f'Reindex {data_type}: alias switched to {target}, but catching up failed. '
+                f'Changes made during the switch may be missing until the next reindex'
+            )
+            return True
+        if target:
+            try:
+                self.loader.drop_version(target)
+            except Exception as error:
+                logger.error(f'Reindex for {data_type}: failed to drop {target}: {error}')
+        return False
+
+    def load_all(
+            self, data_type: str, watermark: Dict[str, str] | None, target: str | None = None
+    ) -> Dict[str, str] | None:
+        """
+        Загружает документы индекса, изменённые после водяного знака, или все документы, если его нет.
+
+        Полная загрузка в новую версию индекса при ETL_RAW_SOURCE берёт документы, собранные в Postgres.
+        Все пачки, в том числе догон через алиас после его переключения, загружаются как пачки полной
+        загрузки: хеши старой версии индекса после переключения всё равно сбрасываются, а ожидание refresh
+        замедлило бы загрузку.
+
+        :param data_type: Название индекса.
+        :param watermark: Водяной знак, с которого начинается выборка.
+        :param target: Версия индекса, в которую пишутся документы.
+        :return: Водяной знак последней загруженной строки.
+        """
+        raw = etl_settings.raw_source and target is not None
+        for rows, batch_watermark in self.extractor.extract(data_type, watermark, raw):
+            if rows:
+                self.load(data_type, rows, target, full=True)
+            if batch_watermark:
+                watermark = batch_watermark
+        return watermark
@@ -1,13 +1,23 @@
-from typing import Dict, List
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List, NamedTuple, Tuple
 
 import backoff
 import psycopg2
 from psycopg2 import DatabaseError, InterfaceError, OperationalError
 from psycopg2.extensions import connection
 from psycopg2.extras import DictCursor
+from psycopg2.pool import ThreadedConnectionPool
 
-from settings.settings import (PostgresDBSettings, SQL_GENRES_QUERY, SQL_MODIFIED_GENRES_QUERY, SQL_MODIFIED_QUERY,
-                               SQL_QUERY, SQL_PERSONS_QUERY, SQL_MODIFIED_PERSONS_QUERY)
+from settings.settings import (logger, PostgresDBSettings, SQL_AFFECTED_GENRES_QUERY, SQL_AFFECTED_MOVIES_QUERY,
+                               SQL_AFFECTED_PERSONS_QUERY, SQL_GENRES_BY_IDS_QUERY,
+                               SQL_CHANGED_MOVIES_QUERY, SQL_CHANGED_PERSONS_QUERY, SQL_MISSING_INDEXES_QUERY,
+                               SQL_LATEST_CHANGES_QUERY,
+                               SQL_GENRES_QUERY, SQL_MODIFIED_GENRES_QUERY, SQL_MODIFIED_QUERY, SQL_QUERY,
+                               SQL_PERSONS_QUERY, SQL_MODIFIED_PERSONS_QUERY, SQL_RENAMED_GENRES_MOVIES_QUERY,
+                               SQL_MOVIES_SOURCE_QUERY, SQL_RENAMED_PERSONS_MOVIES_QUERY)
+from state import ZERO_UUID
 
 
 class DBConnectionError(Exception):
@@ -15,19 +25,64 @@ class DBConnectionError(Exception):
     pass
 
 
+class PartialUpdates(NamedTuple):
+    """
+    Пачка документов, которые обновляются частично, без пересборки.
+
+    source — таблица, изменение в которой привело к обновлению; rows — строки с id документа
+    и изменившимися данными.
+    """
+    source: str
+    rows: List[Dict]
+
+
+class RawDocuments(NamedTuple):
+    """
+    Пачка документов, собранных в Postgres.
+
+    rows — пары (id документа, `_source` в виде JSON-текста), которые отправляются в Elasticsearch как есть.
+    """
+    rows: List[Tuple[str, str]]
+
+
 class PsExtractor:
     """Класс для извлечения данных из Postgres."""
 
-    def __init__(self, db_settings: PostgresDBSettings) -> None:
+    def __init__(self, db_settings: PostgresDBSettings, itersize: int, partial_updates: bool = False) -> None:
         """
         Инициализация экстрактора с настройками базы данных.
 
         :param db_settings: Настройки базы данных.
+        :param itersize: Размер пачки строк, забираемой с серверного курсора за один раз.
+        :param partial_updates: Изменения персон и жанров применять к фильмам частичными обновлениями.
         """
         self.db_settings = db_settings
+        self.itersize = itersize
+        self.partial_updates = partial_updates
         # self.modified_query: str = SQL_MODIFIED_QUERY
         self.query = {"movies": SQL_QUERY, "genres": SQL_GENRES_QUERY, "persons": SQL_PERSONS_QUERY}
         self.modified_query = {"movies": SQL_MODIFIED_QUERY, "genres": SQL_MODIFIED_GENRES_QUERY, "persons": SQL_MODIFIED_PERSONS_QUERY}
+        self.changes_query = {"movies": SQL_CHANGED_MOVIES_QUERY, "persons": SQL_CHANGED_PERSONS_QUERY}
+        self.affected_query = {"movies": SQL_AFFECTED_MOVIES_QUERY, "genres": SQL_AFFECTED_GENRES_QUERY,
+                               "persons": SQL_AFFECTED_PERSONS_QUERY}
+        self.by_ids_query = {"movies": SQL_MODIFIED_QUERY, "genres": SQL_GENRES_BY_IDS_QUERY,
+                             "persons": SQL_MODIFIED_PERSONS_QUERY}
+        # Изменения в этих таблицах попадают в документы только как имена, поэтому документы
+        # не пересобираются, а получают новые имена.
+        self.partial_query = {"movies": {"person": SQL_RENAMED_PERSONS_MOVIES_QUERY,
+                                         "genre": SQL_RENAMED_GENRES_MOVIES_QUERY}}
+        # Запросы, которые сами собирают `_source` документов, для полной загрузки без моделей.
+        self.source_query = {"movies": SQL_MOVIES_SOURCE_QUERY}
+        self.id_field = {"movies": "id", "genres": "id", "persons": "person_id"}
+        # Таблица, строки которой становятся документами индекса.
+        self.document_source = {"movies": "film_work", "genres": "genre", "persons": "person"}
+        # Таблицы, изменения в которых попадают в документы индекса.
+        self.sources = {"movies": ("film_work", "person", "genre"), "genres": ("genre",),
+                        "persons": ("film_work", "person")}
+        self.indexes_checked = False
+        self.indexes_lock = threading.Lock()
+        self.pool: ThreadedConnectionPool | None = None
+        self.pool_lock = threading.Lock()
 
     @backoff.on_exception(
         backoff.expo,
@@ -37,43 +92,256 @@ class PsExtractor:
     )
     def connect(self) -> connection:
         """
-        Устанавливает соединение с базой данных Postgres с использованием экспоненциального бэкоффа.
+        Берёт соединение из пула, создавая пул при первом обращении. Закрытые соединения заменяются новыми.
+
+        Пул и его соединения живут всё время работы процесса, поэтому новое соединение
+        с экспоненциальным бэкоффом устанавливается только после сбоя.
 
         :return: Соединение с базой данных.
         """
-        return psycopg2.connect(**self.db_settings.dict(), connect_timeout=5)
+        with self.pool_lock:
+            if self.pool is None:
+                self.pool = ThreadedConnectionPool(
+                    1, len(self.query) + 1, **self.db_settings.dict(), connect_timeout=5
+                )
+        connection = self.pool.getconn()
+        if connection.closed:
+            self.pool.putconn(connection, close=True)
+            connection = self.pool.getconn()
+        return connection
 
-    def extract(self, modified: str | None) -> Dict[str, List[Dict]]:
+    def release(self, connection: connection, broken: bool = False) -> None:
         """
-        Извлекает данные из базы данных Postgres, учитывая дату последнего обновления.
+        Возвращает соединение в пул. Соединение, на котором произошла ошибка, закрывается.
 
-        :param modified: Дата последнего обновления для выборки измененных данных.
-        :return: Список извлеченных данных.
+        :param connection: Соединение с базой данных.
+        :param broken: Соединение больше нельзя использовать.
+        """
+        if not broken and not connection.closed:
+            try:
+                connection.rollback()
+            except (OperationalError, InterfaceError):
+                broken = True
+        self.pool.putconn(connection, close=broken or bool(connection.closed))
+
+    @contextmanager
+    def get_connection(self) -> Iterator[connection]:
+        """
+        Выдаёт соединение из пула и возвращает его обратно, превращая ошибки базы данных в DBConnectionError.
+
+        :raises: DBConnectionError
         """
-        data = {
-            'movies': [],
-            'genres': [],
-            'persons': []
-        }
         connection = None
+        broken = False
         try:
             connection = self.connect()
-            with connection.cursor(cursor_factory=DictCursor) as cursor:
-                for data_type in data.keys():
-                    if modified:
-                        if data_type == 'movies':
-                            cursor.execute(self.modified_query[data_type], (modified, modified, modified))
-                        elif data_type == 'genres':
-                            cursor.execute(self.modified_query[data_type], (modified,))
-                        elif data_type == 'persons':
-                            cursor.execute(self.modified_query[data_type], (modified,))
-                    else:
-                        cursor.execute(self.query[data_type])
-                    for record in cursor:
-                        data[data_type].append(dict(record))
+            yield connection
         except (OperationalError, InterfaceError, DatabaseError) as error:
+            broken = True
             raise DBConnectionError(f'Ошибка подключения к БД: {error}.')
         finally:
             if connection:
-                connection.close()
-        return data
+                self.release(connection, broken)
+
+    def close(self) -> None:
+        """Закрывает все соединения пула."""
+        if self.pool:
+            self.pool.closeall()
+            self.pool = None
+
+    def get_changed_indexes(self, watermarks: Dict[str, Dict[str, str] | None]) -> List[str]:
+        """
+        Одним дешёвым запросом по индексам (updated_at, id) определяет, в каких индексах есть изменения.
+
+        :param watermarks: Водяные знаки индексов.
+        :return: Названия индексов, водяной знак которых отстаёт от последних изменений в их таблицах.
+        :raises: DBConnectionError
+        """
+        with self.get_connection() as connection:
+            with connection.cursor(cursor_factory=DictCursor) as cursor:
+                cursor.execute(SQL_LATEST_CHANGES_QUERY)
+                latest = {row['source']: (row['updated_at'], str(row['id'])) for row in cursor.fetchall()}
+
+        changed = []
+        for data_type, sources in self.sources.items():
+            watermark = watermarks.get(data_type)
+            if not watermark:
+                changed.append(data_type)
+                continue
+            position = (datetime.fromisoformat(watermark['updated_at']), watermark['id'])
+            if any(source in latest and latest[source] > position for source in sources):
+                changed.append(data_type)
+        return changed
+
+    def check_indexes(self, connection: connection) -> None:
+        """
+        Проверяет, что в базе есть индексы (updated_at, id), по которым идут keyset-выборки изменений.
+
+        ETL не создаёт их сам: CREATE INDEX на рабочих таблицах блокирует запись и требует прав на DDL.
+        Индексы создаются миграцией, а без них ETL работает, но каждая выборка изменений читает таблицу целиком.
+
+        :param connection: Соединение с базой данных.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(SQL_MISSING_INDEXES_QUERY)
+            missing = [row[0] for row in cursor.fetchall()]
+        connection.commit()
+        if missing:
+            logger.warning(f'Нет индексов {missing}: примените migrations/0001_updated_at_id_indexes.sql')
+        self.indexes_checked = True
+
+    def extract(
+            self, data_type: str, watermark: Dict[str, str] | None, raw: bool = False
+    ) -> Iterator[Tuple[List[Dict] | PartialUpdates | RawDocuments, Dict | None]]:
+        """
+        Извлекает данные для индекса из базы данных Postgres пачками, начиная с водяного знака.
+
+        Вместе с каждой пачкой возвращается водяной знак, до которого можно сдвинуть состояние
+        после её загрузки, или None, если пачка не завершает обработку очередной порции изменений.
+
+        :param data_type: Название индекса.
+        :param watermark: Водяной знак последней загруженной строки.
+        :param raw: При полной загрузке отдавать документы, собранные в Postgres, если для индекса есть такой запрос.
+        :return: Генератор пар (пачка строк, водяной знак).
+        """
+        with self.get_connection() as connection:
+            with self.indexes_lock:
+                if not self.indexes_checked:
+                    self.check_indexes(connection)
+            if watermark and data_type in self.changes_query:
+                yield from self._extract_changes(connection, data_type, watermark)
+            elif raw and not watermark and data_type in self.source_query:
+                yield from self._extract_sources(connection, data_type)
+            else:
+                yield from self._extract_stream(connection, data_type, watermark)
+
+    def extract_by_ids(
+            self, data_type: str, changed_ids: Dict[str, List[str]]
+    ) -> Iterator[List[Dict] | PartialUpdates]:
+        """
+        Извлекает пачками документы индекса, затронутые изменёнными строками с известными id.
+
+        :param data_type: Название индекса.
+        :param changed_ids: id изменённых строк по таблицам: film_work, person, genre.
+        :return: Генератор пачек строк.
+        """
+        with self.get_connection() as connection:
+            with connection.cursor(cursor_factory=DictCursor) as cursor:
+                yield from self._extract_affected(
+                    cursor, data_type, {'film_work': [], 'person': [], 'genre': [], **changed_ids}
+                )
+            connection.commit()
+
+    def _extract_stream(
+            self, connection: connection, data_type: str, watermark: Dict[str, str] | None
+    ) -> Iterator[Tuple[List[Dict], Dict]]:
+        """
+        Потоково читает результат запроса с именованного (серверного) курсора.
+
+        Строки упорядочены по (updated_at, id), поэтому водяным знаком пачки служит её последняя строка.
+        В памяти одновременно находится не больше `itersize` строк.
+        """
+        with connection.cursor(name=f'etl_{data_type}', cursor_factory=DictCursor) as cursor:
+            cursor.itersize = self.itersize
+            if watermark:
+                cursor.execute(self.modified_query[data_type], watermark)
+            else:
+                cursor.execute(self.query[data_type])
+            while rows := cursor.fetchmany(self.itersize):
+                yield [dict(row) for row in rows], self.get_watermark(data_type, rows[-1])
+        connection.commit()
+
+    def _extract_sources(self, connection: connection, data_type: str) -> Iterator[Tuple[RawDocuments, Dict]]:
+        """
+        Потоково читает документы, собранные в Postgres, с именованного (серверного) курсора.
+
+        Строки читаются обычным курсором: `_source` остаётся строкой и не разбирается в Python.
+        """
+        with connection.cursor(name=f'etl_{data_type}_source') as cursor:
+            cursor.itersize = self.itersize
+            cursor.execute(self.source_query[data_type])
+            while rows := cursor.fetchmany(self.itersize):
+                last_id, updated_at, _ = rows[-1]
+                yield (RawDocuments([(str(doc_id), source) for doc_id, _, source in rows]),
+                       {'updated_at': updated_at.isoformat(), 'id': str(last_id)})
+        connection.commit()
+
+    def _extract_changes(
+            self, connection: connection, data_type: str, watermark: Dict[str, str]
+    ) -> Iterator[Tuple[List[Dict] | PartialUpdates, Dict | None]]:
+        """
+        Инкрементальная выборка в три шага, каждый из которых использует индексы:
+
+        1. изменённые строки источников индекса по индексу (updated_at, id);
+        2. id документов, которые они затрагивают, через таблицы связей;
+        3. документы только для этих id, страницами keyset-пагинации по id.
+
+        Водяной знак сдвигается на последнюю изменённую строку после загрузки всех затронутых ею документов,
+        поэтому он отдаётся отдельно, вместе с пустой пачкой.
+        """
+        with connection.cursor(cursor_factory=DictCursor) as cursor:
+            while True:
+                cursor.execute(self.changes_query[data_type], {**watermark, 'limit': self.itersize})
+                changes = cursor.fetchall()
+                if not changes:
+                    break
+                changed_ids = {'film_work': [], 'person': [], 'genre': []}
+                for change in changes:
+                    changed_ids[change['source']].append(str(change['id']))
+                watermark = {'updated_at': changes[-1]['updated_at'].isoformat(), 'id': str(changes[-1]['id'])}
+
+                for rows in self._extract_affected(cursor, data_type, changed_ids):
+                    yield rows, None
+                yield [], watermark
+                connection.commit()
+
+    def _extract_affected(
+            self, cursor: DictCursor, data_type: str, changed_ids: Dict[str, List[str]]
+    ) -> Iterator[List[Dict] | PartialUpdates]:
+        """
+        Шаги 2 и 3 инкрементальной выборки: id затронутых документов страницами keyset-пагинации по id
+        и документы для каждой страницы.
+
+        Если включены частичные обновления, документы, затронутые только переименованием персон или жанров,
+        не пересобираются: для них отдаются пачки PartialUpdates.
+        """
+        if self.partial_updates and data_type in self.partial_query:
+            for source, query in self.partial_query[data_type].items():
+                if changed_ids[source]:
+                    for rows in self._extract_pages(cursor, query, changed_ids):
+                        yield PartialUpdates(source, rows)
+            changed_ids = {**changed_ids, **{source: [] for source in self.partial_query[data_type]}}
+        after = ZERO_UUID
+        while True:
+            cursor.execute(self.affected_query[data_type], {**changed_ids, 'after': after, 'limit': self.itersize})
+            ids = [str(row['id']) for row in cursor.fetchall()]
+            if not ids:
+                return
+            cursor.execute(self.by_ids_query[data_type], {'ids': ids})
+            yield [dict(row) for row in cursor.fetchall()]
+            if len(ids) < self.itersize:
+                return
+            after = ids[-1]
+
+    def _extract_pages(self, cursor: DictCursor, query: str, params: Dict) -> Iterator[List[Dict]]:
+        """Выполняет запрос страницами keyset-пагинации по id."""
+        after = ZERO_UUID
+        while True:
+            cursor.execute(query, {**params, 'after': after, 'limit': self.itersize})
+            rows = [dict(row) for row in cursor.fetchall()]
+            if not rows:
+                return
+            yield rows
+            if len(rows) < self.itersize:
+                return
+            after = str(rows[-1]['id'])
+
+    def get_watermark(self, data_type: str, row: Dict) -> Dict[str, str]:
+        """
+        Возвращает водяной знак строки: пару (updated_at, id), по которой идёт keyset-пагинация.
+
+        :param data_type: Название индекса.
+        :param row: Строка, извлечённая из базы данных.
+        :return: Водяной знак.
+        """
+        return {'updated_at': row['updated_at'].isoformat(), 'id': str(row[self.id_field[data_type]])}
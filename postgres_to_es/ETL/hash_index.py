@@ -0,0 +1,109 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from typing import Dict, List
+
+# Сколько id передаётся в один запрос к SQLite: число параметров запроса ограничено
+QUERY_CHUNK_SIZE = 500
+
+
+class HashIndex:
+    """
+    Хеши `_source` документов, загруженных в Elasticsearch, по индексу и id документа.
+
+    Хранятся в локальном файле SQLite рядом с состоянием ETL. По ним ETL не отправляет документы,
+    которые после изменения строк в Postgres получились такими же, как уже лежат в индексе.
+
+    Хеши привязаны к uuid индекса в Elasticsearch, в который загружены документы: если за алиасом
+    оказывается другой индекс, в том числе созданный заново под тем же именем, хеши сбрасываются.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        :param path: Путь к файлу SQLite.
+        """
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # WAL позволяет процессу полной переиндексации работать с файлом одновременно с основным процессом
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS doc_hash ('
+            'index_name TEXT NOT NULL, doc_id TEXT NOT NULL, hash BLOB NOT NULL, '
+            'PRIMARY KEY (index_name, doc_id)) WITHOUT ROWID'
+        )
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS index_version (index_name TEXT PRIMARY KEY, uuid TEXT NOT NULL)'
+        )
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_hash(source: Dict) -> bytes:
+        """Хеш документа, не зависящий от порядка ключей."""
+        data = json.dumps(source, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+        return hashlib.blake2b(data.encode(), digest_size=16).digest()
+
+    def bind(self, index_name: str, uuid: str) -> bool:
+        """
+        Привязывает хеши индекса к uuid индекса Elasticsearch, который сейчас стоит за алиасом.
+
+        Хеши, сохранённые для другого индекса или без привязки, сбрасываются.
+
+        :param index_name: Название индекса (алиаса).
+        :param uuid: uuid индекса в Elasticsearch.
+        :return: True, если хеши были сброшены.
+        """
+        with self.lock, self.connection:
+            self.connection.execute('BEGIN')
+            row = self.connection.execute(
+                'SELECT uuid FROM index_version WHERE index_name = ?', [index_name]
+            ).fetchone()
+            if row and row[0] == uuid:
+                return False
+            self.connection.execute('DELETE FROM doc_hash WHERE index_name = ?', [index_name])
+            self.connection.execute(
+                'INSERT OR REPLACE INTO index_version (index_name, uuid) VALUES (?, ?)', [index_name, uuid]
+            )
+        return True
+
+    def get_changed(self, index_name: str, hashes: Dict[str, bytes]) -> Dict[str, bytes]:
+        """
+        Отбирает документы, хеш которых отличается от сохранённого или ещё не сохранён.
+
+        :param index_name: Название индекса.
+        :param hashes: Хеши документов по id.
+        :return: Хеши изменившихся документов по id.
+        """
+        saved = {}
+        ids = list(hashes)
+        with self.lock:
+            for start in range(0, len(ids), QUERY_CHUNK_SIZE):
+                chunk = ids[start:start + QUERY_CHUNK_SIZE]
+                placeholders = ','.join('?' * len(chunk))
+                saved.update(self.connection.execute(
+                    f'SELECT doc_id, hash FROM doc_hash WHERE index_name = ? AND doc_id IN ({placeholders})',
+                    [index_name, *chunk],
+                ).fetchall())
+        return {doc_id: doc_hash for doc_id, doc_hash in hashes.items() if saved.get(doc_id) != doc_hash}
+
+    def save(self, index_name: str, hashes: Dict[str, bytes]) -> None:
+        """Сохраняет хеши документов, загруженных в индекс."""
+        if not hashes:
+            return
+        with self.lock, self.connection:
+            self.connection.execute('BEGIN')
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO doc_hash (index_name, doc_id, hash) VALUES (?, ?, ?)',
+                [(index_name, doc_id, doc_hash) for doc_id, doc_hash in hashes.items()],
+            )
+
+    def delete(self, index_name: str, ids: List[str]) -> None:
+        """Забывает хеши документов, изменённых в индексе в обход хешей."""
+        with self.lock, self.connection:
+            self.connection.execute('BEGIN')
+            self.connection.executemany(
+                'DELETE FROM doc_hash WHERE index_name = ? AND doc_id = ?',
+                [(index_name, doc_id) for doc_id in ids],
+            )
+
+    def close(self) -> None:
+        self.connection.close()
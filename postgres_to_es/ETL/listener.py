@@ -0,0 +1,120 @@
+import json
+import select
+import time
+from typing import Dict, List
+
+import backoff
+import psycopg2
+from psycopg2 import DatabaseError, InterfaceError, OperationalError
+from psycopg2.extensions import connection
+
+from extractor import DBConnectionError
+from settings.settings import (
+    NOTIFY_CHANNEL, NOTIFY_TABLES, PostgresDBSettings, SQL_MISSING_NOTIFY_TRIGGERS_QUERY, logger
+)
+
+
+class ChangeListener:
+    """Класс для получения id изменённых строк через LISTEN/NOTIFY."""
+
+    def __init__(self, db_settings: PostgresDBSettings, debounce: float, max_delay: float) -> None:
+        """
+        Инициализация слушателя с настройками базы данных.
+
+        :param db_settings: Настройки базы данных.
+        :param debounce: Сколько секунд ждать следующего уведомления, прежде чем отдать накопленные изменения.
+        :param max_delay: Максимальная задержка отдачи изменений при непрерывном потоке уведомлений.
+        """
+        self.db_settings = db_settings
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.connection: connection | None = None
+
+    @backoff.on_exception(
+        backoff.expo,
+        (OperationalError, InterfaceError, DatabaseError),
+        max_tries=5,
+        max_time=5,
+    )
+    def connect(self) -> connection:
+        """
+        Открывает отдельное соединение в режиме autocommit, проверяет триггеры и подписывается на канал.
+
+        ETL не создаёт триггеры сам: CREATE TRIGGER на рабочих таблицах блокирует запись и требует прав
+        владельца таблиц. Триггеры создаются миграцией, а без них уведомления не приходят, и изменения
+        находит только резервный опрос.
+
+        :return: Соединение с базой данных.
+        """
+        listen_connection = psycopg2.connect(**self.db_settings.dict(), connect_timeout=5)
+        listen_connection.autocommit = True
+        with listen_connection.cursor() as cursor:
+            cursor.execute(SQL_MISSING_NOTIFY_TRIGGERS_QUERY, (NOTIFY_TABLES,))
+            missing = [row[0] for row in cursor.fetchall()]
+            cursor.execute(f'LISTEN {NOTIFY_CHANNEL};')
+        if missing:
+            logger.warning(
+                f'Нет триггеров etl_notify_change на {missing}: примените migrations/0002_notify_triggers.sql'
+            )
+        logger.info(f'Listening for changes on channel {NOTIFY_CHANNEL}')
+        return listen_connection
+
+    def subscribe(self) -> None:
+        """
+        Подписывается на канал, если соединения ещё нет или оно было закрыто.
+
+        :raises: DBConnectionError
+        """
+        if self.connection is None or self.connection.closed:
+            try:
+                self.connection = self.connect()
+            except (OperationalError, InterfaceError, DatabaseError) as error:
+                raise DBConnectionError(f'Ошибка подключения к БД: {error}.')
+
+    def listen(self, timeout: float) -> Dict[str, List[str]]:
+        """
+        Ждёт уведомлений не дольше timeout секунд и склеивает их в одну пачку изменений.
+
+        После первого уведомления пачка собирается, пока уведомления приходят чаще, чем раз в debounce
+        секунд, но не дольше max_delay секунд.
+
+        :param timeout: Сколько секунд ждать первого уведомления.
+        :return: id изменённых строк по таблицам или пустой словарь, если изменений не было.
+        :raises: DBConnectionError
+        """
+        try:
+            self.subscribe()
+            if not self._wait(timeout):
+                return {}
+            changes = {}
+            deadline = time.monotonic() + self.max_delay
+            while True:
+                self._collect(changes)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._wait(min(self.debounce, remaining)):
+                    break
+            return {table: sorted(ids) for table, ids in changes.items()}
+        except (OperationalError, InterfaceError, DatabaseError) as error:
+            self.close()
+            raise DBConnectionError(f'Ошибка подключения к БД: {error}.')
+
+    def _wait(self, timeout: float) -> bool:
+        """Ждёт, пока в соединении появятся уведомления."""
+        if not self.connection.notifies:
+            if select.select([self.connection], [], [], timeout) == ([], [], []):
+                return False
+            self.connection.poll()
+        return bool(self.connection.notifies)
+
+    def _collect(self, changes: Dict[str, set]) -> None:
+        """Забирает накопленные уведомления, убирая повторы id."""
+        while self.connection.notifies:
+            notify = self.connection.notifies.pop(0)
+            for table, row_id in json.loads(notify.payload).items():
+                changes.setdefault(table, set()).add(row_id)
+
+    def close(self) -> None:
+        """Закрывает соединение."""
+        if self.connection and not self.connection.closed:
+            self.connection.close()
+        self.connection = None
@@ -1,15 +1,17 @@
 import logging
-from typing import Dict, List
+import threading
+import time
+from typing import Dict, Iterator, List, Set, Tuple
 
 import backoff
 import elastic_transport
-from elasticsearch import Elasticsearch, helpers
+from elasticsearch import ApiError, Elasticsearch, NotFoundError, helpers
 
 from persons_index import persons_index
+from publisher import ChangePublisher
 from genres_index import genres_index
-from models import GenreModel, MovieModel
 from movies_index import movies_index
-from settings.settings import ElasticsearchSettings
+from settings.settings import ElasticsearchSettings, ETLSettings
 
 
 class ESConnectionError(Exception):
@@ -17,17 +19,44 @@ class ESConnectionError(Exception):
     pass
 
 
+class ESBulkError(Exception):
+    """Кастомное исключение для документов, которые не удалось загрузить после всех повторов."""
+    pass
+
+
+# Статусы, при которых повтор загрузки документа имеет смысл: перегрузка или временная ошибка кластера.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
 class ESLoader:
     """Класс для загрузки данных в Elasticsearch."""
 
-    def __init__(self, es_settings: ElasticsearchSettings) -> None:
+    def __init__(
+            self, es_settings: ElasticsearchSettings, etl_settings: ETLSettings, publisher: ChangePublisher | None = None
+    ) -> None:
         """
         Инициализация загрузчика с настройками Elasticsearch.
 
         :param es_settings: Настройки Elasticsearch.
+        :param etl_settings: Настройки ETL: число потоков, размеры пачек и число повторов bulk-загрузки.
+        :param publisher: Публикатор id загруженных документов для сброса кешей API.
         """
-        self.elastic = Elasticsearch([es_settings.dict()], timeout=5)
+        self.es_settings = es_settings
+        self.publisher = publisher
+        self.elastic = self.connect()
+        self.etl_settings = etl_settings
         self.indexes = {"movies": movies_index, "genres": genres_index, "persons": persons_index}
+        self.indexes_created = False
+        self.indexes_lock = threading.Lock()
+
+    def connect(self) -> Elasticsearch:
+        """
+        Создаёт клиент Elasticsearch. Клиент живёт всё время работы процесса и общий для потоков индексов:
+        после сбоя соединения пул клиента сам переподключается к узлу.
+
+        :return: Клиент Elasticsearch.
+        """
+        return Elasticsearch([self.es_settings.dict()], timeout=5)
 
     @backoff.on_exception(
         backoff.expo,
@@ -39,68 +68,272 @@ class ESLoader:
         """
         Создает индексы в Elasticsearch, если они не существуют.
 
+        Индекс создаётся первой версией `{index}_v1` за алиасом `{index}`, чтобы его можно было
+        перестроить без простоя: см. create_version и swap_alias.
+
         :raises: ConnectionError, ConnectionTimeout
         """
         for index_name, index_setting in self.indexes.items():
             if not self.elastic.indices.exists(index=index_name):
                 self.elastic.indices.create(
-                    index=index_name,
-                    body=index_setting
+                    index=self.get_next_version(index_name),
+                    body={**index_setting, 'aliases': {index_name: {}}}
                 )
 
+    def ensure_indexes(self) -> None:
+        """Создаёт индексы один раз за время жизни клиента."""
+        with self.indexes_lock:
+            if not self.indexes_created:
+                self.create_indexes()
+                self.indexes_created = True
+
+    def get_uuid(self, index_name: str) -> str:
+        """
+        Возвращает uuid индекса, который сейчас стоит за алиасом.
+
+        По нему ETL понимает, что сохранённые хеши документов описывают другой индекс. Индекс,
+        удалённый во время работы ETL, создаётся заново.
+
+        :param index_name: Название индекса (алиаса).
+        :return: uuid индекса в Elasticsearch.
+        :raises: ESConnectionError
+        """
+        try:
+            try:
+                self.ensure_indexes()
+                settings = self._get_uuid_settings(index_name)
+            except NotFoundError:
+                logging.warning(f'Индекс {index_name} не найден и будет создан заново')
+                with self.indexes_lock:
+                    self.indexes_created = False
+                self.ensure_indexes()
+                settings = self._get_uuid_settings(index_name)
+        except (elastic_transport.ConnectionError, elastic_transport.ConnectionTimeout) as error:
+            raise ESConnectionError(f'{error}. Failed to get Elasticsearch index {index_name}')
+        (index_settings,) = settings.values()
+        return index_settings['settings']['index']['uuid']
+
+    @backoff.on_exception(
+        backoff.expo,
+        (elastic_transport.ConnectionError, elastic_transport.ConnectionTimeout),
+        max_tries=5,
+        max_time=5,
+    )
+    def _get_uuid_settings(self, index_name: str) -> Dict:
+        return self.elastic.indices.get_settings(index=index_name, name='index.uuid').body
+
+    def get_versions(self, index_name: str) -> List[str]:
+        """Версии индекса `{index}_v{n}` по возрастанию номера."""
+        prefix = f'{index_name}_v'
+        names = self.elastic.indices.get(index=f'{prefix}*', expand_wildcards='all')
+        numbers = sorted(int(name[len(prefix):]) for name in names if name[len(prefix):].isdigit())
+        return [f'{prefix}{number}' for number in numbers]
+
+    def get_next_version(self, index_name: str) -> str:
+        versions = self.get_versions(index_name)
+        number = int(versions[-1].rsplit('_v', 1)[1]) + 1 if versions else 1
+        return f'{index_name}_v{number}'
+
+    def create_version(self, index_name: str) -> str:
+        """
+        Создаёт новую версию индекса для полной загрузки.
+
+        Пока версия не получила алиас, API её не читает, поэтому она создаётся без реплик и без
+        периодического refresh: загрузка не тратит время на поиск и копирование сегментов.
+
+        :param index_name: Название индекса (алиаса), который читает API.
+        :return: Название созданной версии.
+        """
+        # без этого первая загруженная пачка создала бы индекс под алиасом уже после новой версии
+        self.ensure_indexes()
+        target = self.get_next_version(index_name)
+        index_setting = self.indexes[index_name]
+        settings = {**index_setting['settings'], 'refresh_interval': '-1', 'number_of_replicas': 0}
+        self.elastic.indices.create(index=target, body={**index_setting, 'settings': settings})
+        logging.info(f'Создана версия {target} индекса {index_name}')
+        return target
+
+    def optimize_version(self, index_name: str, target: str) -> None:
+        """
+        Готовит загруженную версию к поиску: сливает сегменты, возвращает refresh и реплики
+        и ждёт, пока кластер разместит шарды.
+
+        :param index_name: Название индекса (алиаса), который читает API.
+        :param target: Название версии.
+        """
+        elastic = self.elastic.options(request_timeout=self.etl_settings.reindex_timeout)
+        elastic.indices.forcemerge(index=target, max_num_segments=1)
+        elastic.indices.put_settings(index=target, settings={'index': {
+            'refresh_interval': self.indexes[index_name]['settings'].get('refresh_interval', '1s'),
+            'number_of_replicas': self.etl_settings.reindex_replicas,
+        }})
+        elastic.indices.refresh(index=target)
+        elastic.cluster.health(index=target, wait_for_status=self.etl_settings.reindex_wait_for_status,
+                               timeout=f'{self.etl_settings.reindex_timeout}s')
+
+    def swap_alias(self, index_name: str, target: str) -> None:
+        """
+        Одним атомарным запросом переключает алиас, который читает API, на новую версию.
+
+        Предыдущая версия остаётся для отката, более старые удаляются. Индекс, созданный до появления
+        версий под именем алиаса, удаляется в том же запросе. Ошибка удаления старых версий не считается
+        ошибкой переключения.
+
+        :param index_name: Название индекса (алиаса), который читает API.
+        :param target: Название новой версии.
+        """
+        actions = [{'add': {'index': target, 'alias': index_name}}]
+        previous = []
+        if self.elastic.indices.exists_alias(name=index_name):
+            previous = list(self.elastic.indices.get_alias(name=index_name))
+            actions.extend({'remove': {'index': name, 'alias': index_name}} for name in previous)
+        elif self.elastic.indices.exists(index=index_name):
+            actions.append({'remove_index': {'index': index_name}})
+        self.elastic.indices.update_aliases(actions=actions)
+        logging.info(f'Алиас {index_name} переключён на {target}')
+        try:
+            stale = [name for name in self.get_versions(index_name) if name != target and name not in previous]
+            if stale:
+                self.elastic.indices.delete(index=','.join(stale))
+                logging.info(f'Удалены старые версии индекса {index_name}: {stale}')
+        except (ApiError, elastic_transport.TransportError) as error:
+            # алиас уже переключён: старые версии будут удалены при следующей переиндексации
+            logging.warning(f'Не удалось удалить старые версии индекса {index_name}: {error}')
+
+    def drop_version(self, target: str) -> None:
+        """Удаляет версию индекса, загрузка которой не завершилась."""
+        self.elastic.indices.delete(index=target, ignore_unavailable=True)
+
+    @staticmethod
+    def get_id(action: Dict) -> str:
+        """Возвращает id документа в Elasticsearch."""
+        return action['_id']
+
+    def generate_actions(self, index_name: str, actions: List[Dict], target: str | None = None) -> Iterator[Dict]:
+        """
+        Добавляет к bulk-действиям индекс, в который они пишутся.
+
+        :param index_name: Название индекса.
+        :param actions: bulk-действия index или update без индекса.
+        :param target: Индекс, в который пишутся документы, если это не index_name.
+        """
+        for action in actions:
+            yield {**action, '_index': target or index_name}
+
     @backoff.on_exception(
         backoff.expo,
         (elastic_transport.ConnectionError, elastic_transport.ConnectionTimeout),
         max_tries=5,
         max_time=5
     )
-    def bulk_data_load(self, data) -> None:
+    def parallel_bulk_load(
+            self, index_name: str, items: List[Dict], target: str | None = None, full: bool = False
+    ) -> Tuple[List[Dict], Set[str]]:
         """
-        Загружает данные в Elasticsearch пакетами.
+        Загружает данные через parallel_bulk и собирает документы, которые не удалось загрузить.
+
+        Ошибки отдельных документов не прерывают загрузку. Документы с временными ошибками возвращаются
+        для повтора, остальные ошибки логируются, а id таких документов возвращаются отдельно.
+
+        Если id документов инкрементальной пачки будут опубликованы, запрос ждёт refresh индекса: иначе API,
+        получив событие, мог бы перечитать из Elasticsearch ещё старые данные и закешировать их. При полной
+        загрузке ожидание задержало бы каждую пачку на время refresh_interval, поэтому документы
+        становятся видны с обычным refresh.
 
-        :param data: Преобразованные данные для загрузки.
+        :param index_name: Название индекса.
+        :param items: bulk-действия index или update без индекса.
+        :param target: Индекс, в который пишутся документы, если это не index_name.
+        :param full: Пачка полной загрузки, а не инкрементальной.
+        :return: Документы, загрузку которых стоит повторить, и id документов, отклонённых Elasticsearch.
         :raises: ConnectionError, ConnectionTimeout
         """
-        # for index_name in self.indexes:
-        #     bulk_data = [
-        #         {
-        #             '_op_type': 'index',
-        #             '_id': item.id,
-        #             '_index': index_name,
-        #             '_source': item.dict()
-        #         }
-        #         for item in data
-        #     ]
-        #     helpers.bulk(self.elastic, bulk_data)
-
-        for index_name, items in data.items():
-            bulk_data = [
-                {
-                    '_op_type': 'index',
-                    '_id': item.person_id if index_name == 'persons' else item.id ,
-                    '_index': index_name,
-                    '_source': item.dict()
-                }
-                for item in items
-            ]
-            helpers.bulk(self.elastic, bulk_data)
-
-    def load(self, data: Dict[str, List[MovieModel | GenreModel]]) -> None:
-        """
-        Метод для загрузки данных в Elasticsearch с обработкой исключений.
-
-        :param data: Преобразованные данные для загрузки.
-        :raises: ESConnectionError
+        retry_ids, rejected_ids = set(), set()
+        for ok, info in helpers.parallel_bulk(
+                self.elastic,
+                self.generate_actions(index_name, items, target),
+                thread_count=self.etl_settings.bulk_thread_count,
+                chunk_size=self.etl_settings.bulk_chunk_size,
+                max_chunk_bytes=self.etl_settings.bulk_max_chunk_bytes,
+                raise_on_error=False,
+                raise_on_exception=False,
+                # в новой версии индекса refresh отключён до конца загрузки, и её никто не читает
+                refresh='wait_for' if self.publisher and not target and not full else None,
+        ):
+            if ok:
+                continue
+            (op_type, result), = info.items()
+            if op_type == 'update' and result.get('status') == 404:
+                # документа ещё нет в индексе: он будет загружен целиком вместе с остальными изменениями фильма
+                continue
+            if result.get('status') in RETRY_STATUSES:
+                retry_ids.add(result['_id'])
+            else:
+                rejected_ids.add(result.get('_id'))
+                logging.error(f'Документ {result.get("_id")} не загружен в {index_name}: {result.get("error")}')
+        retry = [item for item in items if self.get_id(item) in retry_ids] if retry_ids else []
+        return retry, rejected_ids
+
+    def bulk_data_load(
+            self, index_name: str, items: List[Dict], target: str | None = None, full: bool = False
+    ) -> Set[str]:
+        """
+        Загружает пачку данных в Elasticsearch, повторяя загрузку документов с временными ошибками.
+
+        :param index_name: Название индекса.
+        :param items: bulk-действия index или update без индекса.
+        :param target: Индекс, в который пишутся документы, если это не index_name.
+        :param full: Пачка полной загрузки, а не инкрементальной.
+        :return: id документов, отклонённых Elasticsearch.
+        :raises: ConnectionError, ConnectionTimeout, ESBulkError
+        """
+        failed, rejected = self.parallel_bulk_load(index_name, items, target, full)
+        for attempt in range(1, self.etl_settings.bulk_max_retries + 1):
+            if not failed:
+                return rejected
+            logging.warning(f'Повтор загрузки {len(failed)} документов в {index_name}, попытка {attempt}')
+            time.sleep(2 ** attempt / 10)
+            failed, rejected_on_retry = self.parallel_bulk_load(index_name, failed, target, full)
+            rejected |= rejected_on_retry
+        if failed:
+            raise ESBulkError(
+                f'Failed to load {len(failed)} items into Elasticsearch index {index_name} '
+                f'after {self.etl_settings.bulk_max_retries} retries'
+            )
+        return rejected
+
+    def load(
+            self, index_name: str, items: List[Dict], target: str | None = None, full: bool = False
+    ) -> Set[str]:
+        """
+        Метод для загрузки пачки данных в Elasticsearch с обработкой исключений.
+
+        Индексы создаются один раз, при загрузке первой пачки. После загрузки id документов
+        публикуются, чтобы API сбросил их в своих кешах. Загрузка в новую версию индекса не публикуется:
+        API начнёт читать её только после переключения алиаса.
+
+        :param index_name: Название индекса.
+        :param items: bulk-действия index или update без индекса.
+        :param target: Версия индекса, в которую пишутся документы, если это не index_name.
+        :param full: Пачка полной загрузки, а не инкрементальной.
+        :return: id документов, отклонённых Elasticsearch.
+        :raises: ESConnectionError, ESBulkError, PublishError
         """
         try:
-            self.create_indexes()
-            self.bulk_data_load(data)
+            self.ensure_indexes()
+            rejected = self.bulk_data_load(index_name, items, target, full)
         except (elastic_transport.ConnectionError, elastic_transport.ConnectionTimeout) as error:
             logging.error(f'Ошибка загрузки данных в Elasticsearch: {error}')
+            with self.indexes_lock:
+                # индексы могли пропасть вместе с кластером: они будут проверены при следующей загрузке
+                self.indexes_created = False
             raise ESConnectionError(
-                f'{error}. Failed to load data into Elasticsearch: '
-                f'{data}'
+                f'{error}. Failed to load {len(items)} items into Elasticsearch index {index_name}'
             )
-        finally:
-            if self.elastic:
-                self.elastic.close()
+        if self.publisher and not target:
+            self.publisher.publish(index_name, [self.get_id(item) for item in items])
+        return rejected
+
+    def close(self) -> None:
+        """Закрывает соединение с Elasticsearch."""
+        if self.elastic:
+            self.elastic.close()
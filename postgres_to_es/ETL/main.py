@@ -1,15 +1,66 @@
+import argparse
+import sys
 import time
 from state import JsonFileStorage, State
 from ETL import ETL
+from extractor import DBConnectionError
+from listener import ChangeListener
+from settings.settings import db_settings, etl_settings, logger
 import os
 
 
+def run_polling(etl: ETL) -> None:
+    """Опрашивает Postgres на изменения каждые ETL_POLL_INTERVAL секунд."""
+    while True:
+        etl.start()
+        time.sleep(etl_settings.poll_interval)
+
+
+def run_listening(etl: ETL) -> None:
+    """
+    Переиндексирует документы по уведомлениям LISTEN/NOTIFY.
+
+    Опрос изменений остаётся резервным: он догоняет пропущенное при старте, выполняется раз
+    в ETL_FALLBACK_POLL_INTERVAL секунд и каждые ETL_POLL_INTERVAL секунд, пока слушатель недоступен.
+    """
+    listener = ChangeListener(db_settings, etl_settings.notify_debounce, etl_settings.notify_max_delay)
+    next_poll = 0.0
+    try:
+        while True:
+            try:
+                listener.subscribe()
+                if time.monotonic() >= next_poll:
+                    etl.start()
+                    next_poll = time.monotonic() + etl_settings.fallback_poll_interval
+                changes = listener.listen(timeout=max(next_poll - time.monotonic(), 0))
+            except DBConnectionError as error:
+                logger.error(f'Listener failed, falling back to polling: {error}')
+                listener.close()
+                etl.start()
+                time.sleep(etl_settings.poll_interval)
+                continue
+            if changes:
+                etl.apply_changes(changes)
+    finally:
+        listener.close()
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ETL из Postgres в Elasticsearch')
+    parser.add_argument('--reindex', nargs='+', choices=['movies', 'genres', 'persons'],
+                        help='Перестроить индексы в новой версии, переключить на неё алиасы и завершиться')
+    args = parser.parse_args()
     if not os.path.exists('tmp_storage.txt'):
         open('tmp_storage.txt', 'w').close()
     storage = JsonFileStorage(r'tmp_storage.txt')
     state = State(storage)
-    while True:
-        etl = ETL(state)
-        etl.start()
-        time.sleep(5)
+    etl = ETL(state)
+    try:
+        if args.reindex:
+            sys.exit(0 if all([etl.reindex(data_type) for data_type in args.reindex]) else 1)
+        if etl_settings.mode == 'listen':
+            run_listening(etl)
+        else:
+            run_polling(etl)
+    finally:
+        etl.close()
@@ -26,29 +26,17 @@ class MovieModel(BaseModel):
     persons: List[PersonModel] | None = Field(exclude=True)
     description: str | None
 
-    def _get_persons_by_role(self, role: str) -> List[PersonModel]:
-        """Filter persons by role."""
-        if self.persons:
-            return [person for person in self.persons if person.person_role == role]
-        return []
-
-    def _get_persons_names(self, role: str) -> List[str]:
-        """Get list of person names for a given role."""
-        return [person.person_name for person in self._get_persons_by_role(role)]
-
-    def _get_persons_info(self, role: str) -> List[Dict[str, str]]:
-        """Get list of dictionaries with person id and name for a given role."""
-        return [
-            {'id': person.person_id, 'name': person.person_name}
-            for person in self._get_persons_by_role(role)
-        ]
-
-    def dict(self, **kwargs) -> Dict:
-        """Override dict method to include role-based person information."""
-        obj_dict = super().dict(**kwargs)
+    def model_dump(self, **kwargs) -> Dict:
+        """Override model_dump to include role-based person information, splitting persons by role in one pass."""
+        obj_dict = super().model_dump(**kwargs)
+        by_role: Dict[str, List[PersonModel]] = {role_value: [] for role_value in ROLES.values()}
+        for person in self.persons or ():
+            if person.person_role in by_role:
+                by_role[person.person_role].append(person)
         for role_key, role_value in ROLES.items():
-            obj_dict[role_key] = self._get_persons_info(role_value)
-            obj_dict[f'{role_key}_names'] = self._get_persons_names(role_value)
+            persons = by_role[role_value]
+            obj_dict[role_key] = [{'id': person.person_id, 'name': person.person_name} for person in persons]
+            obj_dict[f'{role_key}_names'] = [person.person_name for person in persons]
         return obj_dict
 
 
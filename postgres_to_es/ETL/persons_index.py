@@ -44,6 +44,15 @@ persons_index = {
       "id": {
         "type": "keyword"
       },
+      "person_id": {
+        "type": "text",
+        "fields": {
+          "keyword": {
+            "type": "keyword",
+            "ignore_above": 256
+          }
+        }
+      },
       "full_name": {
         "type": "text"
       },
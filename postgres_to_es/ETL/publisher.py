@@ -0,0 +1,65 @@
+import json
+from typing import List
+
+import backoff
+from redis import Redis
+from redis.exceptions import RedisError
+
+from settings.settings import RedisSettings
+
+# Публикует сообщение, а если его не получил ни один воркер API, сохраняет его в список пропущенных:
+# воркер применит их, когда подпишется на канал. Одним скриптом, чтобы подписка не попала между этими шагами.
+PUBLISH_SCRIPT = """
+if redis.call('PUBLISH', ARGV[1], ARGV[2]) == 0 then
+    redis.call('RPUSH', KEYS[1], ARGV[2])
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+end
+"""
+
+
+class PublishError(Exception):
+    """Кастомное исключение для изменений, о которых не удалось сообщить API."""
+    pass
+
+
+class ChangePublisher:
+    """Класс для публикации id изменённых документов, по которым API сбрасывает свои кеши."""
+
+    def __init__(self, redis_settings: RedisSettings) -> None:
+        """
+        Инициализация публикатора с настройками Redis.
+
+        :param redis_settings: Настройки Redis.
+        """
+        self.redis = Redis(host=redis_settings.host, port=redis_settings.port, socket_timeout=5)
+        self.channel = redis_settings.invalidation_channel
+        self.missed_key = f'{redis_settings.invalidation_channel}: missed'
+        # пропущенные изменения нужны, пока в кеше API могут лежать документы, которых они касаются
+        self.missed_expire = redis_settings.cache_entity_expire
+        self.script = self.redis.register_script(PUBLISH_SCRIPT)
+
+    def publish(self, index_name: str, ids: List[str]) -> None:
+        """
+        Публикует id загруженных документов индекса.
+
+        Если Redis недоступен и после повторов, пачка считается незагруженной: водяной знак не сдвигается,
+        и документы будут загружены и опубликованы снова.
+
+        :param index_name: Название индекса.
+        :param ids: id документов.
+        :raises: PublishError
+        """
+        if not ids:
+            return
+        try:
+            self._publish(json.dumps({'index': index_name, 'ids': ids}))
+        except RedisError as error:
+            raise PublishError(f'Failed to publish {len(ids)} changes of {index_name}: {error}')
+
+    @backoff.on_exception(backoff.expo, RedisError, max_tries=5, max_time=10)
+    def _publish(self, message: str) -> None:
+        self.script(keys=[self.missed_key], args=[self.channel, message, self.missed_expire])
+
+    def close(self) -> None:
+        """Закрывает соединение с Redis."""
+        self.redis.close()
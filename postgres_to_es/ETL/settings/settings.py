@@ -1,5 +1,6 @@
 import logging
 import os
+from typing import Literal
 
 from pydantic import Extra, Field
 from pydantic_settings import BaseSettings
@@ -31,9 +32,142 @@ class ElasticsearchSettings(BaseSettings):
         extra = Extra.ignore
 
 
+class RedisSettings(BaseSettings):
+    host: str = Field(alias='REDIS_HOST')
+    port: int = Field(6379, alias='REDIS_PORT')
+    invalidation_channel: str = Field('es_changes', alias='CACHE_INVALIDATION_CHANNEL')
+    cache_entity_expire: int = Field(60 * 60 * 24, alias='CACHE_ENTITY_EXPIRE')
+
+    class Config:
+        env_file = os.path.join(os.path.dirname(__file__), '..', '..', '.env')
+        extra = Extra.ignore
+
+
+class ETLSettings(BaseSettings):
+    itersize: int = Field(500, alias='ETL_ITERSIZE')
+    bulk_thread_count: int = Field(4, alias='ETL_BULK_THREAD_COUNT')
+    bulk_chunk_size: int = Field(500, alias='ETL_BULK_CHUNK_SIZE')
+    bulk_max_chunk_bytes: int = Field(10 * 1024 * 1024, alias='ETL_BULK_MAX_CHUNK_BYTES')
+    bulk_max_retries: int = Field(3, alias='ETL_BULK_MAX_RETRIES')
+    rejected_retry_interval: float = Field(300, alias='ETL_REJECTED_RETRY_INTERVAL')
+    poll_interval: float = Field(5, alias='ETL_POLL_INTERVAL')
+    mode: Literal['poll', 'listen'] = Field('poll', alias='ETL_MODE')
+    notify_debounce: float = Field(0.5, alias='ETL_NOTIFY_DEBOUNCE')
+    notify_max_delay: float = Field(5, alias='ETL_NOTIFY_MAX_DELAY')
+    fallback_poll_interval: float = Field(60, alias='ETL_FALLBACK_POLL_INTERVAL')
+    transform_workers: int = Field(1, alias='ETL_TRANSFORM_WORKERS')
+    skip_unchanged: bool = Field(True, alias='ETL_SKIP_UNCHANGED')
+    hash_index_path: str = Field('doc_hashes.sqlite', alias='ETL_HASH_INDEX_PATH')
+    partial_updates: bool = Field(True, alias='ETL_PARTIAL_UPDATES')
+    raw_source: bool = Field(False, alias='ETL_RAW_SOURCE')
+    reindex_replicas: int = Field(1, alias='ETL_REINDEX_REPLICAS')
+    reindex_wait_for_status: Literal['yellow', 'green'] = Field('yellow', alias='ETL_REINDEX_WAIT_FOR_STATUS')
+    reindex_timeout: int = Field(3600, alias='ETL_REINDEX_TIMEOUT')
+
+    class Config:
+        env_file = os.path.join(os.path.dirname(__file__), '..', '..', '.env')
+        extra = Extra.ignore
+
+
 db_settings = PostgresDBSettings()
 es_settings = ElasticsearchSettings()
+redis_settings = RedisSettings()
+etl_settings = ETLSettings()
+
+NOTIFY_CHANNEL = 'content_changes'
+
+# Таблицы, на которых migrations/0002_notify_triggers.sql создаёт триггер etl_notify_change
+NOTIFY_TABLES = ['film_work', 'person', 'genre', 'person_film_work', 'genre_film_work']
+
+# Таблицы из NOTIFY_TABLES, на которых нет триггера etl_notify_change
+SQL_MISSING_NOTIFY_TRIGGERS_QUERY = """
+    SELECT required.name
+    FROM unnest(%s::text[]) AS required(name)
+    WHERE NOT EXISTS (
+        SELECT 1 FROM pg_trigger
+        WHERE tgname = 'etl_notify_change' AND tgrelid = to_regclass('content.' || required.name)
+    )
+"""
+
+# Индексы (updated_at, id) из migrations/0001_updated_at_id_indexes.sql, которых нет в базе
+SQL_MISSING_INDEXES_QUERY = """
+    SELECT required.name
+    FROM unnest(ARRAY['film_work_updated_at_id_idx', 'person_updated_at_id_idx', 'genre_updated_at_id_idx'])
+        AS required(name)
+    WHERE NOT EXISTS (SELECT 1 FROM pg_indexes WHERE schemaname = 'content' AND indexname = required.name)
+"""
+
+# Последние изменения в каждой таблице: по одному чтению с конца индекса (updated_at, id).
+SQL_LATEST_CHANGES_QUERY = """
+    (SELECT 'film_work' AS source, updated_at, id FROM content.film_work ORDER BY updated_at DESC, id DESC LIMIT 1)
+    UNION ALL
+    (SELECT 'person' AS source, updated_at, id FROM content.person ORDER BY updated_at DESC, id DESC LIMIT 1)
+    UNION ALL
+    (SELECT 'genre' AS source, updated_at, id FROM content.genre ORDER BY updated_at DESC, id DESC LIMIT 1)
+"""
+
+# Шаг 1 инкрементальной выборки: изменённые строки источников индекса в порядке (updated_at, id).
+# Каждая ветка UNION читает индекс (updated_at, id) своей таблицы начиная с водяного знака.
+SQL_CHANGED_MOVIES_QUERY = """
+    SELECT changed.updated_at, changed.id, changed.source
+    FROM (
+        (SELECT updated_at, id, 'film_work' AS source FROM content.film_work
+         WHERE (updated_at, id) > (%(updated_at)s::timestamptz, %(id)s::uuid)
+         ORDER BY updated_at, id LIMIT %(limit)s)
+        UNION ALL
+        (SELECT updated_at, id, 'person' AS source FROM content.person
+         WHERE (updated_at, id) > (%(updated_at)s::timestamptz, %(id)s::uuid)
+         ORDER BY updated_at, id LIMIT %(limit)s)
+        UNION ALL
+        (SELECT updated_at, id, 'genre' AS source FROM content.genre
+         WHERE (updated_at, id) > (%(updated_at)s::timestamptz, %(id)s::uuid)
+         ORDER BY updated_at, id LIMIT %(limit)s)
+    ) AS changed
+    ORDER BY changed.updated_at, changed.id
+    LIMIT %(limit)s
+"""
+
+# Шаг 2: id фильмов, затронутых изменёнными строками, страница keyset-пагинации по id.
+SQL_AFFECTED_MOVIES_QUERY = """
+    SELECT affected.id
+    FROM (
+        SELECT unnest(%(film_work)s::uuid[]) AS id
+        UNION
+        SELECT pfw.film_work_id FROM content.person_film_work pfw WHERE pfw.person_id = ANY(%(person)s::uuid[])
+        UNION
+        SELECT gfw.film_work_id FROM content.genre_film_work gfw WHERE gfw.genre_id = ANY(%(genre)s::uuid[])
+    ) AS affected
+    WHERE affected.id > %(after)s::uuid
+    ORDER BY affected.id
+    LIMIT %(limit)s
+"""
+
+# Частичные обновления фильмов: новые имена изменённых персон по каждому фильму, в котором они участвуют,
+# страница keyset-пагинации по id фильма.
+SQL_RENAMED_PERSONS_MOVIES_QUERY = """
+    SELECT pfw.film_work_id AS id, jsonb_object_agg(p.id, p.full_name) AS names
+    FROM content.person_film_work pfw
+    JOIN content.person p ON p.id = pfw.person_id
+    WHERE pfw.person_id = ANY(%(person)s::uuid[]) AND pfw.film_work_id > %(after)s::uuid
+    GROUP BY pfw.film_work_id
+    ORDER BY pfw.film_work_id
+    LIMIT %(limit)s
+"""
 
+# Частичные обновления фильмов: полный список жанров каждого фильма с изменёнными жанрами.
+SQL_RENAMED_GENRES_MOVIES_QUERY = """
+    SELECT gfw.film_work_id AS id, array_agg(DISTINCT g.name) AS genres
+    FROM content.genre_film_work gfw
+    JOIN content.genre g ON g.id = gfw.genre_id
+    WHERE gfw.film_work_id IN (
+        SELECT film_work_id FROM content.genre_film_work WHERE genre_id = ANY(%(genre)s::uuid[])
+    ) AND gfw.film_work_id > %(after)s::uuid
+    GROUP BY gfw.film_work_id
+    ORDER BY gfw.film_work_id
+    LIMIT %(limit)s
+"""
+
+# Шаг 3: документы только для страницы затронутых фильмов.
 SQL_MODIFIED_QUERY = """SELECT
    fw.id,
    fw.title,
@@ -50,15 +184,16 @@ SQL_MODIFIED_QUERY = """SELECT
        ) FILTER (WHERE p.id is not null),
        '[]'
    ) as persons,
-   array_agg(DISTINCT g.name) as genres
+   COALESCE (array_agg(DISTINCT g.name) FILTER (WHERE g.id is not null), '{}') as genres,
+   GREATEST(fw.updated_at, MAX(p.updated_at), MAX(g.updated_at)) as updated_at
 FROM content.film_work fw
 LEFT JOIN content.person_film_work pfw ON pfw.film_work_id = fw.id
 LEFT JOIN content.person p ON p.id = pfw.person_id
 LEFT JOIN content.genre_film_work gfw ON gfw.film_work_id = fw.id
 LEFT JOIN content.genre g ON g.id = gfw.genre_id
-WHERE fw.updated_at > %s OR g.updated_at > %s OR p.updated_at > %s
+WHERE fw.id = ANY(%(ids)s::uuid[])
 GROUP BY fw.id
-ORDER BY fw.updated_at;"""
+ORDER BY fw.id"""
 
 SQL_QUERY = """
     SELECT
@@ -77,14 +212,60 @@ SQL_QUERY = """
        ) FILTER (WHERE p.id is not null),
        '[]'
    ) as persons,
-   array_agg(DISTINCT g.name) as genres
+   COALESCE (array_agg(DISTINCT g.name) FILTER (WHERE g.id is not null), '{}') as genres,
+   GREATEST(fw.updated_at, MAX(p.updated_at), MAX(g.updated_at)) as updated_at
 FROM content.film_work fw
 LEFT JOIN content.person_film_work pfw ON pfw.film_work_id = fw.id
 LEFT JOIN content.person p ON p.id = pfw.person_id
 LEFT JOIN content.genre_film_work gfw ON gfw.film_work_id = fw.id
 LEFT JOIN content.genre g ON g.id = gfw.genre_id
 GROUP BY fw.id
-ORDER BY fw.updated_at;
+ORDER BY updated_at, fw.id
+"""
+
+# Готовый `_source` документа фильма, собранный в Postgres, в виде JSON-текста: поля те же, что у MovieModel.
+# Персоны агрегируются отдельно от жанров, поэтому строки связей не перемножаются и DISTINCT не нужен.
+SQL_MOVIES_SOURCE_QUERY = """
+SELECT
+   fw.id,
+   GREATEST(fw.updated_at, p.updated_at, g.updated_at) AS updated_at,
+   json_build_object(
+           'id', fw.id,
+           'imdb_rating', fw.rating,
+           'genres', COALESCE(g.genres, '{}'),
+           'title', fw.title,
+           'description', fw.description,
+           'directors', COALESCE(p.directors, '[]'),
+           'directors_names', COALESCE(p.directors_names, '{}'),
+           'actors', COALESCE(p.actors, '[]'),
+           'actors_names', COALESCE(p.actors_names, '{}'),
+           'writers', COALESCE(p.writers, '[]'),
+           'writers_names', COALESCE(p.writers_names, '{}')
+   )::text AS source
+FROM content.film_work fw
+CROSS JOIN LATERAL (
+    SELECT
+        json_agg(json_build_object('id', p.id, 'name', p.full_name) ORDER BY p.id)
+            FILTER (WHERE pfw.role = 'director') AS directors,
+        array_agg(p.full_name ORDER BY p.id) FILTER (WHERE pfw.role = 'director') AS directors_names,
+        json_agg(json_build_object('id', p.id, 'name', p.full_name) ORDER BY p.id)
+            FILTER (WHERE pfw.role = 'actor') AS actors,
+        array_agg(p.full_name ORDER BY p.id) FILTER (WHERE pfw.role = 'actor') AS actors_names,
+        json_agg(json_build_object('id', p.id, 'name', p.full_name) ORDER BY p.id)
+            FILTER (WHERE pfw.role = 'writer') AS writers,
+        array_agg(p.full_name ORDER BY p.id) FILTER (WHERE pfw.role = 'writer') AS writers_names,
+        MAX(p.updated_at) AS updated_at
+    FROM content.person_film_work pfw
+    JOIN content.person p ON p.id = pfw.person_id
+    WHERE pfw.film_work_id = fw.id
+) p
+CROSS JOIN LATERAL (
+    SELECT array_agg(DISTINCT g.name) AS genres, MAX(g.updated_at) AS updated_at
+    FROM content.genre_film_work gfw
+    JOIN content.genre g ON g.id = gfw.genre_id
+    WHERE gfw.film_work_id = fw.id
+) g
+ORDER BY updated_at, fw.id
 """
 
 SQL_GENRES_QUERY = """
@@ -94,7 +275,7 @@ SQL_GENRES_QUERY = """
         g.description,
         g.updated_at
     FROM content.genre g
-    ORDER BY g.updated_at;
+    ORDER BY g.updated_at, g.id
 """
 
 SQL_MODIFIED_GENRES_QUERY = """
@@ -104,17 +285,63 @@ SQL_MODIFIED_GENRES_QUERY = """
         g.description,
         g.updated_at
     FROM content.genre g
-    WHERE g.updated_at > %s
-    ORDER BY g.updated_at;
+    WHERE (g.updated_at, g.id) > (%(updated_at)s::timestamptz, %(id)s::uuid)
+    ORDER BY g.updated_at, g.id
+"""
+
+SQL_AFFECTED_GENRES_QUERY = """
+    SELECT affected.id
+    FROM unnest(%(genre)s::uuid[]) AS affected(id)
+    WHERE affected.id > %(after)s::uuid
+    ORDER BY affected.id
+    LIMIT %(limit)s
+"""
+
+SQL_GENRES_BY_IDS_QUERY = """
+    SELECT
+        g.id,
+        g.name,
+        g.description,
+        g.updated_at
+    FROM content.genre g
+    WHERE g.id = ANY(%(ids)s::uuid[])
+    ORDER BY g.id
+"""
+
+SQL_CHANGED_PERSONS_QUERY = """
+    SELECT changed.updated_at, changed.id, changed.source
+    FROM (
+        (SELECT updated_at, id, 'film_work' AS source FROM content.film_work
+         WHERE (updated_at, id) > (%(updated_at)s::timestamptz, %(id)s::uuid)
+         ORDER BY updated_at, id LIMIT %(limit)s)
+        UNION ALL
+        (SELECT updated_at, id, 'person' AS source FROM content.person
+         WHERE (updated_at, id) > (%(updated_at)s::timestamptz, %(id)s::uuid)
+         ORDER BY updated_at, id LIMIT %(limit)s)
+    ) AS changed
+    ORDER BY changed.updated_at, changed.id
+    LIMIT %(limit)s
+"""
+
+SQL_AFFECTED_PERSONS_QUERY = """
+    SELECT affected.id
+    FROM (
+        SELECT unnest(%(person)s::uuid[]) AS id
+        UNION
+        SELECT pfw.person_id FROM content.person_film_work pfw WHERE pfw.film_work_id = ANY(%(film_work)s::uuid[])
+    ) AS affected
+    WHERE affected.id > %(after)s::uuid
+    ORDER BY affected.id
+    LIMIT %(limit)s
 """
 
-SQL_MODIFIED_PERSONS_QUERY= """
+SQL_MODIFIED_PERSONS_QUERY = """
     SELECT 
             person_with_films.person_id, 
             person_with_films.full_name,
             ARRAY_AGG(distinct
                 jsonb_build_object('id', person_with_films.film_id, 'roles', roles, 'title', person_with_films.film_title, 'imdb_rating', person_with_films.film_rating)) AS films,
-            person_with_films.updated_at
+            MAX(person_with_films.updated_at) AS updated_at
     FROM (
             SELECT 
                 film.id as film_id,
@@ -123,32 +350,27 @@ SQL_MODIFIED_PERSONS_QUERY= """
                 person.id as person_id, 
                 person.full_name as full_name,
                 ARRAY_AGG(DISTINCT (person_film.role)) AS roles,
-                GREATEST(film.updated_at, MAX(genre.updated_at), MAX(person.updated_at)) as updated_at
+                GREATEST(film.updated_at, person.updated_at) as updated_at
             FROM 
-                content.film_work film
-                LEFT JOIN content.genre_film_work AS genre_film ON film.id = genre_film.film_work_id
-                LEFT JOIN content.genre AS genre ON genre_film.genre_id = genre.id
-                LEFT JOIN content.person_film_work AS person_film ON film.id = person_film.film_work_id
-                LEFT JOIN content.person as person on person.id = person_film.person_id
-            WHERE person.id is not null and GREATEST(film.updated_at, genre.updated_at, person.updated_at) >= %s
+                content.person as person
+                JOIN content.person_film_work AS person_film ON person.id = person_film.person_id
+                JOIN content.film_work film ON film.id = person_film.film_work_id
+            WHERE person.id = ANY(%(ids)s::uuid[])
             GROUP BY 
-                film.id, person.id, person.full_name
+                film.id, person.id
         ) AS person_with_films
     GROUP BY 
-        person_with_films.person_id, person_with_films.full_name, person_with_films.updated_at
-    ORDER BY updated_at;
+        person_with_films.person_id, person_with_films.full_name
+    ORDER BY person_with_films.person_id
 """
 
-
-
-
 SQL_PERSONS_QUERY = """
     SELECT 
             person_with_films.person_id, 
             person_with_films.full_name,
             ARRAY_AGG(distinct
                 jsonb_build_object('id', person_with_films.film_id, 'roles', roles, 'title', person_with_films.film_title, 'imdb_rating', person_with_films.film_rating)) AS films,
-            person_with_films.updated_at
+            MAX(person_with_films.updated_at) AS updated_at
     FROM (
             SELECT 
                 film.id as film_id,
@@ -157,18 +379,15 @@ SQL_PERSONS_QUERY = """
                 person.id as person_id, 
                 person.full_name as full_name,
                 ARRAY_AGG(DISTINCT (person_film.role)) AS roles,
-                GREATEST(film.updated_at, MAX(genre.updated_at), MAX(person.updated_at)) as updated_at
+                GREATEST(film.updated_at, person.updated_at) as updated_at
             FROM 
                 content.film_work film
-                LEFT JOIN content.genre_film_work AS genre_film ON film.id = genre_film.film_work_id
-                LEFT JOIN content.genre AS genre ON genre_film.genre_id = genre.id
-                LEFT JOIN content.person_film_work AS person_film ON film.id = person_film.film_work_id
-                LEFT JOIN content.person as person on person.id = person_film.person_id
-            WHERE person.id is not null and GREATEST(film.updated_at, genre.updated_at, person.updated_at) >= 'epoch'
+                JOIN content.person_film_work AS person_film ON film.id = person_film.film_work_id
+                JOIN content.person as person on person.id = person_film.person_id
             GROUP BY 
-                film.id, person.id, person.full_name
+                film.id, person.id
         ) AS person_with_films
     GROUP BY 
-        person_with_films.person_id, person_with_films.full_name, person_with_films.updated_at
-    ORDER BY updated_at;
-"""
\ No newline at end of file
+        person_with_films.person_id, person_with_films.full_name
+    ORDER BY updated_at, person_with_films.person_id
+"""
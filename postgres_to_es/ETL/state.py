@@ -1,37 +1,92 @@
-import datetime
+import json
 import logging
+import os
+import threading
+from typing import Dict, List, Set
 
 logger = logging.getLogger(__name__)
 
+ZERO_UUID = '00000000-0000-0000-0000-000000000000'
+
 
 class JsonFileStorage:
     def __init__(self, file_path: str):
         self.file_path = file_path
 
-    def write(self, modified: str) -> None:
+    def write(self, state: Dict) -> None:
+        """Атомарно сохраняет состояние: пишет во временный файл и переименовывает его поверх старого."""
+        tmp_path = f'{self.file_path}.tmp'
         try:
-            with open(self.file_path, 'w') as file:
-                file.write(modified)
-                logger.info(f'write new state {modified}')
+            with open(tmp_path, 'w') as file:
+                json.dump(state, file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, self.file_path)
+            logger.info(f'write new state {state}')
         except IOError as e:
             logger.error(f'Error writing state to file: {e}')
 
-    def read(self) -> str | None:
+    def read(self) -> Dict:
         try:
             with open(self.file_path, 'r') as file:
-                return file.read()
+                content = file.read().strip()
         except IOError as e:
             logger.error(f'Error reading state from file: {e}')
-            return None
+            return {}
+        if not content:
+            return {}
+        try:
+            return json.loads(content)
+        except json.JSONDecodeError:
+            # Старый формат: одна общая дата последнего запуска для всех индексов.
+            logger.warning(f'Migrating legacy state {content!r}')
+            return {'legacy': {'updated_at': content, 'id': ZERO_UUID}}
 
 
 class State:
+    """
+    Хранит для каждого индекса водяной знак: пару (updated_at, id) последней загруженной строки.
+
+    Пара используется как курсор keyset-пагинации, поэтому после сбоя загрузка продолжается
+    ровно с того места, где остановилась.
+
+    Там же хранятся id документов, которые Elasticsearch отклонил: водяной знак уходит дальше них,
+    и без этого списка они не были бы загружены, пока не изменятся их строки.
+    """
+
     def __init__(self, storage: JsonFileStorage) -> None:
         self.storage = storage
+        self.state = storage.read()
+        self.lock = threading.Lock()
+
+    def get_state(self, index_name: str) -> Dict[str, str] | None:
+        return self.state.get(index_name, self.state.get('legacy'))
+
+    def set_state(self, index_name: str, watermark: Dict[str, str]) -> None:
+        with self.lock:
+            self.state[index_name] = watermark
+            self.storage.write(self.state)
+
+    def get_rejected(self, index_name: str) -> List[str]:
+        return self.state.get('rejected', {}).get(index_name, [])
 
-    def get_state(self) -> str | None:
-        return self.storage.read()
+    def add_rejected(self, index_name: str, ids: Set[str]) -> None:
+        """Запоминает id отклонённых документов индекса для повторной загрузки."""
+        ids = {doc_id for doc_id in ids if doc_id}
+        if not ids:
+            return
+        with self.lock:
+            rejected = self.state.setdefault('rejected', {})
+            rejected[index_name] = sorted(ids.union(rejected.get(index_name, [])))
+            self.storage.write(self.state)
 
-    def set_state(self) -> None:
-        modified = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f+00")
-        self.storage.write(modified)
+    def discard_rejected(self, index_name: str, ids: Set[str]) -> None:
+        """Забывает id документов, которые удалось загрузить."""
+        with self.lock:
+            rejected = self.state.get('rejected', {})
+            remaining = set(rejected.get(index_name, [])) - ids
+            if remaining:
+                rejected[index_name] = sorted(remaining)
+            else:
+                rejected.pop(index_name, None)
+            self.storage.write(self.state)
@@ -1,30 +1,130 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from typing import Dict, List
 
-from models import GenreModel, MovieModel, PersonModel
+from extractor import PartialUpdates, RawDocuments
+from models import ROLES, GenreModel, MovieModel, PersonModel
 from settings.settings import logger
 
+MODELS = {
+    'movies': MovieModel,
+    'genres': GenreModel,
+    'persons': PersonModel,
+}
+
+ID_FIELDS = {
+    'movies': 'id',
+    'genres': 'id',
+    'persons': 'person_id',
+}
+
+# Заменяет имена переименованных персон во вложенных списках фильма и пересобирает *_names только для тех ролей,
+# где имя изменилось. Если ничего не изменилось, документ не переиндексируется.
+RENAME_PERSONS_SCRIPT = """
+    boolean changed = false;
+    for (def role : params.roles) {
+        def persons = ctx._source[role];
+        if (persons == null) {
+            continue;
+        }
+        boolean roleChanged = false;
+        for (def person : persons) {
+            def name = params.names[person.id];
+            if (name != null && name != person.name) {
+                person.name = name;
+                roleChanged = true;
+            }
+        }
+        if (roleChanged) {
+            def names = new ArrayList();
+            for (def person : persons) {
+                names.add(person.name);
+            }
+            ctx._source[role + '_names'] = names;
+            changed = true;
+        }
+    }
+    if (!changed) {
+        ctx.op = 'noop';
+    }
+"""
+
+
+def transform_rows(data_type: str, rows: List[Dict]) -> List[Dict]:
+    """
+    Преобразование пачки сырых строк из БД в bulk-действия index для загрузки в Elastic.
+
+    Документ собирается сразу после валидации строки, поэтому модели всей пачки не живут в памяти одновременно.
+    """
+    model = MODELS[data_type]
+    id_field = ID_FIELDS[data_type]
+    actions = []
+    for row in rows:
+        try:
+            item = model.model_validate(row)
+        except Exception as er:
+            logger.error(f'Ошибка преобразования данных {row=}, {er=}')
+            continue
+        actions.append({'_op_type': 'index', '_id': getattr(item, id_field), '_source': item.model_dump()})
+    return actions
+
 
 class DataTransformer:
-    """Класс для преобразования данных из Postgres для загрузки в Elastic."""
+    """
+    Класс для преобразования данных из Postgres для загрузки в Elastic.
+
+    Если задано больше одного процесса, пачка делится на части, которые преобразуются в пуле процессов:
+    валидация и сборка документов упираются в процессор, а потоки ETL делят одно ядро из-за GIL.
+    """
+
+    def __init__(self, workers: int = 1) -> None:
+        """
+        :param workers: Число процессов для преобразования; 1 — преобразование в текущем процессе.
+        """
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context('spawn')
+        ) if workers > 1 else None
+
+    def transform(self, data_type: str, rows: List[Dict]) -> List[Dict]:
+        """Преобразование пачки сырых строк из БД в bulk-действия index для загрузки в Elastic."""
+        # маленькую пачку дешевле преобразовать на месте, чем передавать в другие процессы
+        if not self.executor or len(rows) < self.workers * 2:
+            return transform_rows(data_type, rows)
+        size = -(-len(rows) // self.workers)
+        chunks = [rows[start:start + size] for start in range(0, len(rows), size)]
+        return [action for actions in self.executor.map(transform_rows, [data_type] * len(chunks), chunks)
+                for action in actions]
 
     @staticmethod
-    def transform(rows_from_postgres: Dict[str, List[Dict]]) -> Dict[str, List[MovieModel | GenreModel | PersonModel]]:
-        """Преобразование сырых данных из БД в объекты для загрузки в Elastic."""
-        transformed_data = {
-            'movies': [],
-            'genres': [],
-            'persons': []
-        }
-        for data_type, rows in rows_from_postgres.items():
-            for row in rows:
-                try:
-                    if data_type == 'movies':
-                        transformed_data['movies'].append(MovieModel(**row))
-                    elif data_type == 'genres':
-                        transformed_data['genres'].append(GenreModel(**row))
-                    elif data_type == 'persons':
-                        transformed_data['persons'].append(PersonModel(**row))
-                except Exception as er:
-                    logger.error(f'Ошибка преобразования данных {row=}, {er=}')
-                    continue
-        return transformed_data
+    def transform_updates(updates: PartialUpdates) -> List[Dict]:
+        """
+        Преобразование пачки частичных обновлений в bulk-действия update.
+
+        Новые имена персон применяются скриптом, новые списки жанров заменяют поле целиком.
+        """
+        if updates.source == 'person':
+            return [{
+                '_op_type': 'update',
+                '_id': str(row['id']),
+                'script': {'source': RENAME_PERSONS_SCRIPT, 'params': {'roles': list(ROLES), 'names': row['names']}},
+            } for row in updates.rows]
+        return [{
+            '_op_type': 'update',
+            '_id': str(row['id']),
+            'doc': {'genres': row['genres']},
+        } for row in updates.rows]
+
+    @staticmethod
+    def transform_sources(documents: RawDocuments) -> List[Dict]:
+        """
+        Преобразование пачки документов, собранных в Postgres, в bulk-действия index.
+
+        `_source` остаётся JSON-текстом: клиент Elasticsearch передаёт строки в тело bulk-запроса без сериализации.
+        """
+        return [{'_op_type': 'index', '_id': doc_id, '_source': source} for doc_id, source in documents.rows]
+
+    def close(self) -> None:
+        """Останавливает пул процессов."""
+        if self.executor:
+            self.executor.shutdown()
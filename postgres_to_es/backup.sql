@@ -25,6 +25,37 @@ CREATE SCHEMA content;
 
 ALTER SCHEMA content OWNER TO app;
 
+--
+-- Name: etl_notify_change(); Type: FUNCTION; Schema: content; Owner: app
+--
+
+CREATE FUNCTION content.etl_notify_change() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+DECLARE
+    changed record;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        changed := OLD;
+    ELSE
+        changed := NEW;
+    END IF;
+    IF TG_TABLE_NAME = 'person_film_work' THEN
+        PERFORM pg_notify('content_changes', json_build_object(
+            'film_work', changed.film_work_id, 'person', changed.person_id)::text);
+    ELSIF TG_TABLE_NAME = 'genre_film_work' THEN
+        PERFORM pg_notify('content_changes', json_build_object(
+            'film_work', changed.film_work_id, 'genre', changed.genre_id)::text);
+    ELSE
+        PERFORM pg_notify('content_changes', json_build_object(TG_TABLE_NAME, changed.id)::text);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+
+ALTER FUNCTION content.etl_notify_change() OWNER TO app;
+
 SET default_tablespace = '';
 
 SET default_table_access_method = heap;
@@ -14045,6 +14076,27 @@ CREATE INDEX person_film_work_film_work_id_1724c536 ON content.person_film_work
 CREATE INDEX person_film_work_person_id_196d24de ON content.person_film_work USING btree (person_id);
 
 
+--
+-- Name: film_work_updated_at_id_idx; Type: INDEX; Schema: content; Owner: app
+--
+
+CREATE INDEX film_work_updated_at_id_idx ON content.film_work USING btree (updated_at, id);
+
+
+--
+-- Name: genre_updated_at_id_idx; Type: INDEX; Schema: content; Owner: app
+--
+
+CREATE INDEX genre_updated_at_id_idx ON content.genre USING btree (updated_at, id);
+
+
+--
+-- Name: person_updated_at_id_idx; Type: INDEX; Schema: content; Owner: app
+--
+
+CREATE INDEX person_updated_at_id_idx ON content.person USING btree (updated_at, id);
+
+
 --
 -- Name: auth_group_name_a6ea08ec_like; Type: INDEX; Schema: public; Owner: app
 --
@@ -14136,6 +14188,41 @@ CREATE INDEX django_session_expire_date_a5c62663 ON public.django_session USING
 CREATE INDEX django_session_session_key_c0390e0f_like ON public.django_session USING btree (session_key varchar_pattern_ops);
 
 
+--
+-- Name: film_work etl_notify_change; Type: TRIGGER; Schema: content; Owner: app
+--
+
+CREATE TRIGGER etl_notify_change AFTER INSERT OR UPDATE ON content.film_work FOR EACH ROW EXECUTE FUNCTION content.etl_notify_change();
+
+
+--
+-- Name: genre etl_notify_change; Type: TRIGGER; Schema: content; Owner: app
+--
+
+CREATE TRIGGER etl_notify_change AFTER INSERT OR UPDATE ON content.genre FOR EACH ROW EXECUTE FUNCTION content.etl_notify_change();
+
+
+--
+-- Name: genre_film_work etl_notify_change; Type: TRIGGER; Schema: content; Owner: app
+--
+
+CREATE TRIGGER etl_notify_change AFTER INSERT OR UPDATE OR DELETE ON content.genre_film_work FOR EACH ROW EXECUTE FUNCTION content.etl_notify_change();
+
+
+--
+-- Name: person etl_notify_change; Type: TRIGGER; Schema: content; Owner: app
+--
+
+CREATE TRIGGER etl_notify_change AFTER INSERT OR UPDATE ON content.person FOR EACH ROW EXECUTE FUNCTION content.etl_notify_change();
+
+
+--
+-- Name: person_film_work etl_notify_change; Type: TRIGGER; Schema: content; Owner: app
+--
+
+CREATE TRIGGER etl_notify_change AFTER INSERT OR UPDATE OR DELETE ON content.person_film_work FOR EACH ROW EXECUTE FUNCTION content.etl_notify_change();
+
+
 --
 -- Name: genre_film_work genre_film_work_film_work_id_65abe300_fk_film_work_id; Type: FK CONSTRAINT; Schema: content; Owner: app
 --
@@ -0,0 +1,184 @@
+"""
+Бенчмарк стоимости одного опроса изменений для индекса movies: старый запрос с OR по трём
+updated_at против поэтапной keyset-выборки.
+
+Создаёт в базе из настроек ETL (переменные DB_*) схему `bench_content` с синтетическими данными,
+прогоняет оба варианта и удаляет схему. Запуск из каталога postgres_to_es:
+
+    python benchmarks/incremental_queries.py --films 100000 --changed 10
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import psycopg2
+from psycopg2.extras import DictCursor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'ETL'))
+
+from settings.settings import (db_settings, SQL_AFFECTED_MOVIES_QUERY, SQL_CHANGED_MOVIES_QUERY,  # noqa: E402
+                               SQL_MODIFIED_QUERY)
+from state import ZERO_UUID  # noqa: E402
+
+SCHEMA = 'bench_content'
+
+LEGACY_MODIFIED_QUERY = """SELECT
+   fw.id,
+   fw.title,
+   fw.description,
+   fw.rating,
+   fw.type,
+   COALESCE (
+       json_agg(
+           DISTINCT jsonb_build_object(
+               'person_role', pfw.role,
+               'person_id', p.id,
+               'person_name', p.full_name
+           )
+       ) FILTER (WHERE p.id is not null),
+       '[]'
+   ) as persons,
+   array_agg(DISTINCT g.name) as genres
+FROM content.film_work fw
+LEFT JOIN content.person_film_work pfw ON pfw.film_work_id = fw.id
+LEFT JOIN content.person p ON p.id = pfw.person_id
+LEFT JOIN content.genre_film_work gfw ON gfw.film_work_id = fw.id
+LEFT JOIN content.genre g ON g.id = gfw.genre_id
+WHERE fw.updated_at > %s OR g.updated_at > %s OR p.updated_at > %s
+GROUP BY fw.id
+ORDER BY fw.updated_at;"""
+
+FIXTURE = """
+    DROP SCHEMA IF EXISTS {schema} CASCADE;
+    CREATE SCHEMA {schema};
+    CREATE TABLE {schema}.film_work (
+        updated_at timestamptz NOT NULL, id uuid PRIMARY KEY, title text NOT NULL,
+        description text, rating double precision, type text NOT NULL
+    );
+    CREATE TABLE {schema}.person (updated_at timestamptz NOT NULL, id uuid PRIMARY KEY, full_name text NOT NULL);
+    CREATE TABLE {schema}.genre (
+        updated_at timestamptz NOT NULL, id uuid PRIMARY KEY, name text NOT NULL, description text
+    );
+    CREATE TABLE {schema}.person_film_work (
+        id uuid PRIMARY KEY, role text NOT NULL, film_work_id uuid NOT NULL, person_id uuid NOT NULL
+    );
+    CREATE TABLE {schema}.genre_film_work (id uuid PRIMARY KEY, film_work_id uuid NOT NULL, genre_id uuid NOT NULL);
+
+    INSERT INTO {schema}.film_work
+    SELECT now() - random() * interval '365 days', gen_random_uuid(), 'Film ' || i, 'Description ' || i,
+           round((random() * 10)::numeric, 1), 'movie'
+    FROM generate_series(1, %(films)s) AS i;
+    INSERT INTO {schema}.person
+    SELECT now() - random() * interval '365 days', gen_random_uuid(), 'Person ' || i
+    FROM generate_series(1, %(persons)s) AS i;
+    INSERT INTO {schema}.genre
+    SELECT now() - random() * interval '365 days', gen_random_uuid(), 'Genre ' || i, NULL
+    FROM generate_series(1, 30) AS i;
+
+    INSERT INTO {schema}.person_film_work
+    SELECT gen_random_uuid(), (ARRAY['actor', 'writer', 'director'])[1 + (n %% 3)], f.id, p.id
+    FROM (SELECT id, row_number() OVER () AS rn FROM {schema}.film_work) AS f
+    CROSS JOIN generate_series(1, 5) AS n
+    JOIN (SELECT id, row_number() OVER () AS rn FROM {schema}.person) AS p
+        ON p.rn = 1 + ((f.rn * 7 + n * 13) %% %(persons)s);
+    INSERT INTO {schema}.genre_film_work
+    SELECT gen_random_uuid(), f.id, g.id
+    FROM (SELECT id, row_number() OVER () AS rn FROM {schema}.film_work) AS f
+    CROSS JOIN generate_series(1, 2) AS n
+    JOIN (SELECT id, row_number() OVER () AS rn FROM {schema}.genre) AS g ON g.rn = 1 + ((f.rn + n * 11) %% 30);
+
+    CREATE INDEX ON {schema}.person_film_work (film_work_id);
+    CREATE INDEX ON {schema}.person_film_work (person_id);
+    CREATE INDEX ON {schema}.genre_film_work (film_work_id);
+    CREATE INDEX ON {schema}.genre_film_work (genre_id);
+    CREATE INDEX ON {schema}.film_work (updated_at, id);
+    CREATE INDEX ON {schema}.person (updated_at, id);
+    CREATE INDEX ON {schema}.genre (updated_at, id);
+"""
+
+
+def in_schema(query: str) -> str:
+    return query.replace('content.', f'{SCHEMA}.')
+
+
+def legacy_poll(cursor, watermark: dict) -> int:
+    cursor.execute(in_schema(LEGACY_MODIFIED_QUERY), (watermark['updated_at'],) * 3)
+    return len(cursor.fetchall())
+
+
+def staged_poll(cursor, watermark: dict, limit: int) -> int:
+    documents = 0
+    while True:
+        cursor.execute(in_schema(SQL_CHANGED_MOVIES_QUERY), {**watermark, 'limit': limit})
+        changes = cursor.fetchall()
+        if not changes:
+            return documents
+        changed_ids = {'film_work': [], 'person': [], 'genre': []}
+        for change in changes:
+            changed_ids[change['source']].append(str(change['id']))
+        watermark = {'updated_at': changes[-1]['updated_at'], 'id': str(changes[-1]['id'])}
+        after = ZERO_UUID
+        while True:
+            cursor.execute(in_schema(SQL_AFFECTED_MOVIES_QUERY), {**changed_ids, 'after': after, 'limit': limit})
+            ids = [str(row['id']) for row in cursor.fetchall()]
+            if not ids:
+                break
+            cursor.execute(in_schema(SQL_MODIFIED_QUERY), {'ids': ids})
+            documents += len(cursor.fetchall())
+            after = ids[-1]
+
+
+def measure(poll, repeat: int) -> tuple[float, int]:
+    timings = []
+    result = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = poll()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--films', type=int, default=100_000)
+    parser.add_argument('--persons', type=int, default=50_000)
+    parser.add_argument('--changed', type=int, default=10, help='Сколько персон изменить перед опросом')
+    parser.add_argument('--limit', type=int, default=500, help='Размер страницы (ETL_ITERSIZE)')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    connection = psycopg2.connect(**db_settings.dict())
+    try:
+        with connection.cursor(cursor_factory=DictCursor) as cursor:
+            print(f'Creating fixture: {args.films} films, {args.persons} persons')
+            cursor.execute(FIXTURE.format(schema=SCHEMA), {'films': args.films, 'persons': args.persons})
+            cursor.execute(f'ANALYZE {SCHEMA}.film_work, {SCHEMA}.person, {SCHEMA}.genre, '
+                           f'{SCHEMA}.person_film_work, {SCHEMA}.genre_film_work')
+            cursor.execute('SELECT now() AS updated_at')
+            watermark = {'updated_at': cursor.fetchone()['updated_at'], 'id': ZERO_UUID}
+            connection.commit()
+
+            print(f'{"poll":<24}{"legacy, ms":>12}{"staged, ms":>12}{"docs":>8}')
+            for title in ('idle', f'{args.changed} persons changed'):
+                if title != 'idle':
+                    cursor.execute(
+                        f'UPDATE {SCHEMA}.person SET updated_at = now() '
+                        f'WHERE id IN (SELECT id FROM {SCHEMA}.person ORDER BY random() LIMIT %s)',
+                        (args.changed,)
+                    )
+                    connection.commit()
+                legacy_ms, legacy_docs = measure(lambda: legacy_poll(cursor, watermark), args.repeat)
+                staged_ms, staged_docs = measure(lambda: staged_poll(cursor, watermark, args.limit), args.repeat)
+                assert legacy_docs == staged_docs, (legacy_docs, staged_docs)
+                print(f'{title:<24}{legacy_ms:>12.1f}{staged_ms:>12.1f}{staged_docs:>8}')
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP SCHEMA IF EXISTS {SCHEMA} CASCADE')
+        connection.commit()
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
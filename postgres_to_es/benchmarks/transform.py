@@ -0,0 +1,118 @@
+"""
+Бенчмарк этапа преобразования для индекса movies: прежний путь (модель на каждую строку, шесть проходов
+по персонам и dict) против DataTransformer, собирающего bulk-действия в одном и нескольких процессах.
+
+Строки синтетические, база не нужна. Запуск из каталога postgres_to_es:
+
+    python benchmarks/transform.py --rows 50000 --persons 30 --workers 1 2 4
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+from typing import Dict, List
+
+from pydantic import BaseModel, Field
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'ETL'))
+
+from models import ROLES  # noqa: E402
+from transformer import DataTransformer  # noqa: E402
+
+GENRES = ['Action', 'Comedy', 'Drama', 'Sci-Fi', 'Thriller', 'Documentary']
+
+
+class LegacyPersonModel(BaseModel):
+    person_id: str
+    person_name: str
+    person_role: str
+
+
+class LegacyMovieModel(BaseModel):
+    """Модель фильма до однопроходного разбора персон по ролям."""
+    id: str
+    imdb_rating: float | None = Field(alias='rating')
+    genres: List[str]
+    title: str
+    persons: List[LegacyPersonModel] | None = Field(exclude=True)
+    description: str | None
+
+    def _get_persons_by_role(self, role: str) -> List[LegacyPersonModel]:
+        if self.persons:
+            return [person for person in self.persons if person.person_role == role]
+        return []
+
+    def dict(self, **kwargs) -> Dict:
+        obj_dict = super().model_dump(**kwargs)
+        for role_key, role_value in ROLES.items():
+            obj_dict[role_key] = [
+                {'id': person.person_id, 'name': person.person_name}
+                for person in self._get_persons_by_role(role_value)
+            ]
+            obj_dict[f'{role_key}_names'] = [person.person_name for person in self._get_persons_by_role(role_value)]
+        return obj_dict
+
+
+def make_rows(count: int, persons: int) -> List[Dict]:
+    """Строки в том виде, в каком их отдаёт SQL_QUERY."""
+    roles = list(ROLES.values())
+    return [{
+        'id': str(uuid.uuid4()),
+        'title': f'Film {number}',
+        'description': 'Lorem ipsum dolor sit amet. ' * 10,
+        'rating': round(random.uniform(1, 10), 1),
+        'type': 'movie',
+        'genres': random.sample(GENRES, 2),
+        'persons': [{
+            'person_id': str(uuid.uuid4()),
+            'person_name': f'Person {number}-{index}',
+            'person_role': random.choice(roles),
+        } for index in range(persons)],
+    } for number in range(count)]
+
+
+def legacy_transform(rows: List[Dict]) -> List[Dict]:
+    actions = []
+    for row in rows:
+        item = LegacyMovieModel(**row)
+        actions.append({'_op_type': 'index', '_id': item.id, '_source': item.dict()})
+    return actions
+
+
+def measure(transform, rows: List[Dict], batch: int) -> float:
+    """Строк в секунду при преобразовании пачками по batch строк, как в ETL."""
+    started = time.perf_counter()
+    for start in range(0, len(rows), batch):
+        transform(rows[start:start + batch])
+    return len(rows) / (time.perf_counter() - started)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=50_000)
+    parser.add_argument('--persons', type=int, default=30, help='Сколько персон у фильма')
+    parser.add_argument('--batch', type=int, default=500, help='Размер пачки (ETL_ITERSIZE)')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    args = parser.parse_args()
+
+    print(f'Generating {args.rows} rows, {args.persons} persons each')
+    rows = make_rows(args.rows, args.persons)
+
+    print(f'{"transform":<24}{"rows/s":>12}')
+    legacy = measure(legacy_transform, rows, args.batch)
+    print(f'{"legacy":<24}{legacy:>12.0f}')
+    for workers in args.workers:
+        transformer = DataTransformer(workers)
+        try:
+            # первая пачка запускает процессы пула, её время в замер не входит
+            transformer.transform('movies', rows[:args.batch])
+            speed = measure(lambda batch: transformer.transform('movies', batch), rows, args.batch)
+        finally:
+            transformer.close()
+        print(f'{f"transformer, workers={workers}":<24}{speed:>12.0f}{speed / legacy:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
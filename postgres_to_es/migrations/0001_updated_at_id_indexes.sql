@@ -0,0 +1,12 @@
+-- Индексы (updated_at, id), по которым ETL выбирает изменения keyset-пагинацией.
+--
+-- В новой базе они создаются из backup.sql. В существующую базу миграция применяется владельцем схемы,
+-- а не ETL, без блокировки записи в таблицы:
+--
+--     psql "$DATABASE_URL" -f postgres_to_es/migrations/0001_updated_at_id_indexes.sql
+--
+-- CREATE INDEX CONCURRENTLY нельзя выполнять в транзакции, поэтому файл нельзя запускать с --single-transaction.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS film_work_updated_at_id_idx ON content.film_work USING btree (updated_at, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS person_updated_at_id_idx ON content.person USING btree (updated_at, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS genre_updated_at_id_idx ON content.genre USING btree (updated_at, id);
@@ -0,0 +1,49 @@
+-- Триггеры, которые публикуют id изменённых строк в канал content_changes (NOTIFY_CHANNEL в настройках ETL).
+-- Для таблиц связей публикуются id обеих связанных сущностей, поэтому удаление связи тоже приводит
+-- к переиндексации.
+--
+-- В новой базе они создаются из backup.sql. В существующую базу миграция применяется владельцем схемы,
+-- а не ETL:
+--
+--     psql "$DATABASE_URL" -1 -f postgres_to_es/migrations/0002_notify_triggers.sql
+--
+-- DROP TRIGGER и CREATE TRIGGER ненадолго блокируют запись в таблицы, поэтому миграцию лучше применять
+-- в спокойное время. CREATE OR REPLACE TRIGGER не используется: его нет в Postgres до 14 версии.
+
+CREATE OR REPLACE FUNCTION content.etl_notify_change() RETURNS trigger AS $$
+DECLARE
+    changed record;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        changed := OLD;
+    ELSE
+        changed := NEW;
+    END IF;
+    IF TG_TABLE_NAME = 'person_film_work' THEN
+        PERFORM pg_notify('content_changes', json_build_object(
+            'film_work', changed.film_work_id, 'person', changed.person_id)::text);
+    ELSIF TG_TABLE_NAME = 'genre_film_work' THEN
+        PERFORM pg_notify('content_changes', json_build_object(
+            'film_work', changed.film_work_id, 'genre', changed.genre_id)::text);
+    ELSE
+        PERFORM pg_notify('content_changes', json_build_object(TG_TABLE_NAME, changed.id)::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS etl_notify_change ON content.film_work;
+CREATE TRIGGER etl_notify_change AFTER INSERT OR UPDATE ON content.film_work
+    FOR EACH ROW EXECUTE FUNCTION content.etl_notify_change();
+DROP TRIGGER IF EXISTS etl_notify_change ON content.person;
+CREATE TRIGGER etl_notify_change AFTER INSERT OR UPDATE ON content.person
+    FOR EACH ROW EXECUTE FUNCTION content.etl_notify_change();
+DROP TRIGGER IF EXISTS etl_notify_change ON content.genre;
+CREATE TRIGGER etl_notify_change AFTER INSERT OR UPDATE ON content.genre
+    FOR EACH ROW EXECUTE FUNCTION content.etl_notify_change();
+DROP TRIGGER IF EXISTS etl_notify_change ON content.person_film_work;
+CREATE TRIGGER etl_notify_change AFTER INSERT OR UPDATE OR DELETE ON content.person_film_work
+    FOR EACH ROW EXECUTE FUNCTION content.etl_notify_change();
+DROP TRIGGER IF EXISTS etl_notify_change ON content.genre_film_work;
+CREATE TRIGGER etl_notify_change AFTER INSERT OR UPDATE OR DELETE ON content.genre_film_work
+    FOR EACH ROW EXECUTE FUNCTION content.etl_notify_change();
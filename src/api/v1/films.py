@@ -1,23 +1,49 @@
+import asyncio
 from http import HTTPStatus
 from typing import Annotated
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 from src.models.film import Film, FilmPreview
 from src.services.film import FilmService, get_film_service
+from src.core.config import settings
+from src.api.v1.utils import gzip_stream, next_cursor_header
 
 router = APIRouter()
 
 
+@router.get('/export', response_class=StreamingResponse, summary='Export the whole films catalogue as NDJSON')
+async def export_films(
+        fields: Annotated[list[str], Query(description='Film fields to export, all by default')] = None,
+        gzip: Annotated[bool, Query(description='Compress the stream with gzip')] = False,
+        film_service: FilmService = Depends(get_film_service)
+) -> StreamingResponse:
+    """
+    Stream every film in the catalogue as newline-delimited JSON, one film per line. The export walks a consistent
+    snapshot of the index, so films changed during the export do not appear twice or go missing.
+    """
+    unknown = set(fields or ()) - set(Film.model_fields)
+    if unknown:
+        raise HTTPException(status_code=HTTPStatus.UNPROCESSABLE_ENTITY,
+                            detail=f'unknown fields: {", ".join(sorted(unknown))}')
+    content = film_service.export(fields or list(Film.model_fields))
+    if gzip:
+        return StreamingResponse(gzip_stream(content), media_type='application/x-ndjson',
+                                 headers={'Content-Encoding': 'gzip'})
+    return StreamingResponse(content, media_type='application/x-ndjson')
+
+
 @router.get('/{film_id}', response_model=Film, summary='Retrieve film details by ID')
-async def film_details(film_id: str, film_service: FilmService = Depends(get_film_service)) -> Film:
+async def film_details(film_id: str, film_service: FilmService = Depends(get_film_service)) -> Response:
     """
     Fetch detailed information about a film, including title, genres, imdb rating, actors, and other information
     by providing its unique film ID
     """
-    film = await film_service.get_by_id(film_id)
+    async with asyncio.timeout(settings.api_entity_timeout):
+        film = await film_service.get_by_id(film_id)
     if not film:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail='film not found')
 
-    return Film(**film.model_dump(by_alias=True))
+    return Response(content=film, media_type='application/json')
 
 
 @router.get('/', response_model=list[FilmPreview], summary='Retrieve a list of films with pagination and filters')
@@ -25,15 +51,26 @@ async def get_films(
         page_size: Annotated[int, Query(description='Pagination page size', ge=1)] = 10,
         page: Annotated[int, Query(description='Pagination page number', ge=1)] = 1,
         sort: Annotated[str, Query(description='Sorting field')] = 'imdb_rating',
-        genre: Annotated[str, Query(description='Filter by genre')] = None,
+        genre: Annotated[list[str], Query(description='Filter by genre id or name, films in any of the genres')] = None,
+        rating_from: Annotated[float, Query(description='Minimum IMDb rating', ge=0)] = None,
+        rating_to: Annotated[float, Query(description='Maximum IMDb rating', ge=0)] = None,
+        person: Annotated[str, Query(description='Filter by id of an actor, writer or director')] = None,
+        cursor: Annotated[str, Query(description='Opaque cursor from the X-Next-Cursor header of the previous page, '
+                                                 'replaces page')] = None,
+        snapshot: Annotated[bool, Query(description='Walk the pages over a point-in-time snapshot of the index')] = False,
         film_service: FilmService = Depends(get_film_service)
-) -> list[Film]:
+) -> Response:
     """
-    Fetch a paginated list of films with optional sorting by fields like IMDb rating and optional filtering by genre.
-    The response contains a film id, and basic details like title and rating.
+    Fetch a paginated list of films with optional sorting by fields like IMDb rating and optional filtering by genres,
+    IMDb rating range and person.
+    The response contains a film id, and basic details like title and rating. To walk the whole list pass the
+    X-Next-Cursor header of each page as the cursor of the next request.
     """
-    films = await film_service.all(page_size=page_size, page=page, sort=sort, genre=genre)
-    return films
+    async with asyncio.timeout(settings.api_list_timeout):
+        films, next_cursor = await film_service.all(page_size=page_size, page=page, sort=sort, genre=genre,
+                                                    rating_from=rating_from, rating_to=rating_to, person=person,
+                                                    cursor=cursor, snapshot=snapshot)
+    return Response(content=films, media_type='application/json', headers=next_cursor_header(next_cursor))
 
 
 @router.get('/search/', response_model=list[FilmPreview], summary='Search films by title with pagination and sorting')
@@ -42,11 +79,22 @@ async def search_films_by_title(
         page: Annotated[int, Query(description='Pagination page number', ge=1)] = 1,
         sort: Annotated[str, Query(description='Sorting field')] = 'imdb_rating',
         query: Annotated[str, Query(description='Search by film name')] = None,
+        genre: Annotated[list[str], Query(description='Filter by genre id or name, films in any of the genres')] = None,
+        rating_from: Annotated[float, Query(description='Minimum IMDb rating', ge=0)] = None,
+        rating_to: Annotated[float, Query(description='Maximum IMDb rating', ge=0)] = None,
+        person: Annotated[str, Query(description='Filter by id of an actor, writer or director')] = None,
+        cursor: Annotated[str, Query(description='Opaque cursor from the X-Next-Cursor header of the previous page, '
+                                                 'replaces page')] = None,
+        snapshot: Annotated[bool, Query(description='Walk the pages over a point-in-time snapshot of the index')] = False,
         film_service: FilmService = Depends(get_film_service)
-) -> list[FilmPreview]:
+) -> Response:
     """
     Perform a search for films by their title. Supports pagination for managing large result sets and allows sorting
-    by fields such as IMDb rating. The response contains a film id, and basic details like title and imdb rating.
+    by fields such as IMDb rating. Results can be narrowed with the same filters as the films list.
+    The response contains a film id, and basic details like title and imdb rating. The X-Next-Cursor header of each page is the cursor of the next one.
     """
-    films = await film_service.all(page_size=page_size, page=page, sort=sort, query=query)
-    return films
+    async with asyncio.timeout(settings.api_search_timeout):
+        films, next_cursor = await film_service.all(page_size=page_size, page=page, sort=sort, query=query,
+                                                    genre=genre, rating_from=rating_from, rating_to=rating_to,
+                                                    person=person, cursor=cursor, snapshot=snapshot)
+    return Response(content=films, media_type='application/json', headers=next_cursor_header(next_cursor))
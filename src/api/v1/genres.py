@@ -1,10 +1,12 @@
-
+import asyncio
 from http import HTTPStatus
 from typing import Annotated
 from fastapi import APIRouter, Depends, HTTPException
 from src.models.genre import Genre
 from src.services.genre import GenreService, get_genre_service
-from fastapi import APIRouter, Depends, HTTPException, Query
+from src.core.config import settings
+from src.api.v1.utils import next_cursor_header
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 
 
 router = APIRouter()
@@ -13,22 +15,28 @@ router = APIRouter()
 async def get_genres(
         page_size: Annotated[int, Query(description='Pagination page size', ge=1)] = 10,
         page: Annotated[int, Query(description='Pagination page number', ge=1)] = 1,
+        cursor: Annotated[str, Query(description='Opaque cursor from the X-Next-Cursor header of the previous page, '
+                                                 'replaces page')] = None,
+        snapshot: Annotated[bool, Query(description='Walk the pages over a point-in-time snapshot of the index')] = False,
         genre_service: GenreService = Depends(get_genre_service)
-) -> list[Genre]:
+) -> Response:
     """
     Fetch a paginated list of available film genres. Supports pagination to navigate through large sets of genres,
     providing id, name and description fro each genre.
     """
-    films = await genre_service.all(page_size=page_size, page=page)
-    return films
+    async with asyncio.timeout(settings.api_list_timeout):
+        genres, next_cursor = await genre_service.all(page_size=page_size, page=page, cursor=cursor,
+                                                      snapshot=snapshot)
+    return Response(content=genres, media_type='application/json', headers=next_cursor_header(next_cursor))
 
 @router.get('/{genre_id}', response_model=Genre, summary='Retrieve genre details by ID')
-async def genre_details(genre_id: str, genre_service: GenreService = Depends(get_genre_service)) -> Genre:
+async def genre_details(genre_id: str, genre_service: GenreService = Depends(get_genre_service)) -> Response:
     """
     Fetch information (id, name and description) about a specific genre by providing its unique genre ID. If the genre is not found,
     a 404 error will be returned.
     """
-    genre = await genre_service.get_by_id(genre_id)
+    async with asyncio.timeout(settings.api_entity_timeout):
+        genre = await genre_service.get_by_id(genre_id)
     if not genre:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail='genre not found')
-    return genre.model_dump()
+    return Response(content=genre, media_type='application/json')
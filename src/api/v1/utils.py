@@ -0,0 +1,19 @@
+import zlib
+from typing import AsyncIterator
+
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+
+def next_cursor_header(next_cursor: str | None) -> dict[str, str] | None:
+    """Заголовок с курсором следующей страницы, если она есть."""
+    return {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+
+
+async def gzip_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Сжимает поток в gzip по мере чтения, не накапливая его в памяти."""
+    compressor = zlib.compressobj(wbits=31)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
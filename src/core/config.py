@@ -1,4 +1,5 @@
 import os
+from typing import Literal
 from logging import config as logging_config
 from pydantic import Field
 from src.core.logger import LOGGING
@@ -16,10 +17,47 @@ class Settings(BaseSettings):
     project_name: str = Field('movies', alias='PROJECT_NAME')
     redis_host: str = Field(..., alias='REDIS_HOST')
     redis_port: int = Field(6379, alias='REDIS_PORT')
+    redis_socket_path: str | None = Field(None, alias='REDIS_SOCKET_PATH')
+    redis_max_connections: int = Field(100, alias='REDIS_MAX_CONNECTIONS')
+    redis_pool_timeout: float = Field(5, alias='REDIS_POOL_TIMEOUT')
+    redis_socket_timeout: float | None = Field(5, alias='REDIS_SOCKET_TIMEOUT')
+    redis_socket_keepalive: bool = Field(True, alias='REDIS_SOCKET_KEEPALIVE')
+    redis_health_check_interval: int = Field(30, alias='REDIS_HEALTH_CHECK_INTERVAL')
     es_schema: str = Field('http://', alias='ES_SCHEMA')
     es_host: str = Field(..., alias='ES_HOST')
     es_port: int = Field(9200, alias='ES_PORT')
+    es_connections_per_node: int = Field(10, alias='ES_CONNECTIONS_PER_NODE')
+    es_http_compress: bool = Field(False, alias='ES_HTTP_COMPRESS')
+    es_request_timeout: float = Field(10, alias='ES_REQUEST_TIMEOUT')
+    es_max_retries: int = Field(2, alias='ES_MAX_RETRIES')
+    es_retry_on_timeout: bool = Field(False, alias='ES_RETRY_ON_TIMEOUT')
+    es_sniff_on_start: bool = Field(False, alias='ES_SNIFF_ON_START')
+    es_sniff_on_node_failure: bool = Field(False, alias='ES_SNIFF_ON_NODE_FAILURE')
+    es_min_delay_between_sniffing: float = Field(60, alias='ES_MIN_DELAY_BETWEEN_SNIFFING')
+    es_pit_keep_alive: str = Field('1m', alias='ES_PIT_KEEP_ALIVE')
+    export_batch_size: int = Field(1000, alias='EXPORT_BATCH_SIZE')
+    api_entity_timeout: float = Field(2, alias='API_ENTITY_TIMEOUT')
+    api_list_timeout: float = Field(5, alias='API_LIST_TIMEOUT')
+    api_search_timeout: float = Field(5, alias='API_SEARCH_TIMEOUT')
     base_dir: str = Field(BASE_DIR, alias='BASE_DIR')
+    cache_lock_enabled: bool = Field(False, alias='CACHE_LOCK_ENABLED')
+    cache_lock_timeout: float = Field(5, alias='CACHE_LOCK_TIMEOUT')
+    local_cache_maxsize: int = Field(1024, alias='LOCAL_CACHE_MAXSIZE')
+    local_cache_ttl: float = Field(10, alias='LOCAL_CACHE_TTL')
+    cache_invalidation_channel: str = Field('es_changes', alias='CACHE_INVALIDATION_CHANNEL')
+    cache_entity_expire: int = Field(60 * 60 * 24, alias='CACHE_ENTITY_EXPIRE')
+    cache_list_expire: int = Field(60 * 60, alias='CACHE_LIST_EXPIRE')
+    cache_entity_soft_ttl: int = Field(60 * 60, alias='CACHE_ENTITY_SOFT_TTL')
+    cache_list_soft_ttl: int = Field(60 * 5, alias='CACHE_LIST_SOFT_TTL')
+    cache_codec: Literal['json', 'msgpack'] = Field('json', alias='CACHE_CODEC')
+    cache_compression: Literal['none', 'zstd', 'lz4'] = Field('none', alias='CACHE_COMPRESSION')
+    cache_compression_threshold: int = Field(1024, alias='CACHE_COMPRESSION_THRESHOLD')
+    hot_lists_enabled: bool = Field(True, alias='HOT_LISTS_ENABLED')
+    hot_lists_sorts: list[str] = Field(['imdb_rating'], alias='HOT_LISTS_SORTS')
+    hot_lists_pages: int = Field(5, alias='HOT_LISTS_PAGES')
+    hot_lists_page_size: int = Field(10, alias='HOT_LISTS_PAGE_SIZE')
+    hot_lists_refresh_delay: float = Field(1, alias='HOT_LISTS_REFRESH_DELAY')
+    hot_lists_soft_ttl: int = Field(60 * 5, alias='HOT_LISTS_SOFT_TTL')
 
 
 settings = Settings()
@@ -1,7 +1,30 @@
 from elasticsearch import AsyncElasticsearch
 
+from src.core.config import settings
+
 es: AsyncElasticsearch | None = None
 
+
+def create_elastic() -> AsyncElasticsearch:
+    """
+    Создаёт клиент Elasticsearch с настройками транспорта из конфигурации.
+
+    По таймауту запрос по умолчанию не повторяется: повтор медленного запроса только добавляет нагрузку
+    на перегруженный кластер. Узлы кластера можно находить через sniffing, если он из нескольких узлов.
+    """
+    return AsyncElasticsearch(
+        hosts=[f'{settings.es_schema}{settings.es_host}:{settings.es_port}'],
+        connections_per_node=settings.es_connections_per_node,
+        http_compress=settings.es_http_compress,
+        request_timeout=settings.es_request_timeout,
+        max_retries=settings.es_max_retries,
+        retry_on_timeout=settings.es_retry_on_timeout,
+        sniff_on_start=settings.es_sniff_on_start,
+        sniff_on_node_failure=settings.es_sniff_on_node_failure,
+        min_delay_between_sniffing=settings.es_min_delay_between_sniffing,
+    )
+
+
 # Функция понадобится при внедрении зависимостей
 async def get_elastic() -> AsyncElasticsearch:
-    return es
\ No newline at end of file
+    return es
@@ -1,7 +1,38 @@
-from redis.asyncio import Redis
+from redis.asyncio import BlockingConnectionPool, Redis
+from redis.asyncio.connection import UnixDomainSocketConnection
+
+from src.core.config import settings
 
 redis: Redis | None = None
 
+
+def create_redis() -> Redis:
+    """
+    Создаёт клиент Redis с общим пулом соединений.
+
+    Когда все соединения заняты, запрос ждёт освободившееся не дольше REDIS_POOL_TIMEOUT, а не открывает
+    новое. Если задан REDIS_SOCKET_PATH, Redis на той же машине доступен через unix-сокет без TCP.
+    """
+    connection_kwargs = {
+        'socket_timeout': settings.redis_socket_timeout,
+        'health_check_interval': settings.redis_health_check_interval,
+    }
+    if settings.redis_socket_path:
+        connection_kwargs.update(connection_class=UnixDomainSocketConnection, path=settings.redis_socket_path)
+    else:
+        connection_kwargs.update(
+            host=settings.redis_host,
+            port=settings.redis_port,
+            socket_keepalive=settings.redis_socket_keepalive,
+        )
+    pool = BlockingConnectionPool(
+        max_connections=settings.redis_max_connections,
+        timeout=settings.redis_pool_timeout,
+        **connection_kwargs,
+    )
+    return Redis.from_pool(pool)
+
+
 # Функция понадобится при внедрении зависимостей
 async def get_redis() -> Redis:
-    return redis
\ No newline at end of file
+    return redis
@@ -1,20 +1,31 @@
-from elasticsearch import AsyncElasticsearch
-from fastapi import FastAPI
+from elastic_transport import ConnectionTimeout
+from fastapi import FastAPI, Request
 from fastapi.responses import ORJSONResponse
-from redis.asyncio import Redis
 from src.api.v1 import films, genres, persons
 from src.db import elastic, redis
 from src.core.config import settings
+from src.services.hot_lists import HotLists
+from src.services.invalidation import listen_invalidations
+from src.services.pagination import InvalidCursorError
+from http import HTTPStatus
 from contextlib import asynccontextmanager
+import asyncio
 
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    redis.redis = Redis(host=settings.redis_host, port=settings.redis_port)
-    elastic.es = AsyncElasticsearch(hosts=[f'{settings.es_schema}{settings.es_host}:{settings.es_port}'])
+    redis.redis = redis.create_redis()
+    elastic.es = elastic.create_elastic()
+    tasks = [asyncio.create_task(listen_invalidations(redis.redis))]
+    if settings.hot_lists_enabled:
+        tasks.append(asyncio.create_task(HotLists(redis.redis, elastic.es).run()))
     yield
-    await redis.redis.close()
+    for task in tasks:
+        task.cancel()
+    # забирает результаты задач, чтобы их ошибки не терялись
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await redis.redis.aclose()
     await elastic.es.close()
 
 
@@ -26,6 +37,19 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+
+@app.exception_handler(InvalidCursorError)
+async def invalid_cursor_handler(request: Request, exc: InvalidCursorError) -> ORJSONResponse:
+    return ORJSONResponse(status_code=HTTPStatus.BAD_REQUEST, content={'detail': str(exc)})
+
+
+@app.exception_handler(TimeoutError)
+@app.exception_handler(ConnectionTimeout)
+async def timeout_handler(request: Request, exc: Exception) -> ORJSONResponse:
+    # запрос не уложился в отведённое обработчику время или Elasticsearch не ответил вовремя
+    return ORJSONResponse(status_code=HTTPStatus.GATEWAY_TIMEOUT, content={'detail': 'request timed out'})
+
+
 app.include_router(films.router, prefix='/api/v1/films', tags=['films'])
 app.include_router(genres.router, prefix='/api/v1/genres', tags=['genres'])
 app.include_router(persons.router, prefix='/api/v1/persons', tags=['persons'])
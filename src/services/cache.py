@@ -0,0 +1,81 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, TypeVar
+
+from redis.asyncio import Redis
+
+from src.services.codec import codec
+from src.services.single_flight import single_flight
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# Значение из кеша и признак того, что его мягкий срок жизни истёк
+Cached = tuple[bytes, bool]
+
+# Фоновые обновления, на которые нужно держать ссылки, пока они выполняются
+_refreshes: set[asyncio.Task] = set()
+
+
+def wrap(data: bytes, soft_ttl: int | None) -> bytes:
+    """
+    Кодирует значение для Redis вместе с моментом, после которого оно считается устаревшим.
+
+    Жёсткий срок жизни — это срок жизни ключа в Redis. Без soft_ttl значение не устаревает.
+    """
+    return codec.encode(data, soft_ttl)
+
+
+def unwrap(value: bytes | None) -> Cached | None:
+    """Декодирует значение из Redis; значения в неизвестном формате считаются промахом."""
+    return codec.decode(value)
+
+
+async def get_or_fetch(
+        key: str,
+        read: Callable[[], Awaitable[Cached | None]],
+        fetch: Callable[[], Awaitable[T]],
+        redis: Redis,
+) -> bytes | T:
+    """
+    Отдаёт значение из кеша, а при промахе загружает его через fetch.
+
+    Устаревшее значение отдаётся сразу, а в фоне запускается одно обновление на ключ.
+    Ждать Elasticsearch приходится, только если значения в кеше нет совсем.
+    """
+    cached = await read()
+    if cached is None:
+        return await single_flight(key, fetch, lambda: _read_any(read), redis)
+    data, stale = cached
+    if stale:
+        _refresh(key, read, fetch, redis)
+    return data
+
+
+def _refresh(
+        key: str,
+        read: Callable[[], Awaitable[Cached | None]],
+        fetch: Callable[[], Awaitable[T]],
+        redis: Redis,
+) -> None:
+    task = asyncio.create_task(single_flight(key, fetch, lambda: _read_fresh(read), redis))
+    _refreshes.add(task)
+    task.add_done_callback(_refresh_done)
+
+
+def _refresh_done(task: asyncio.Task) -> None:
+    _refreshes.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.warning(f'Background cache refresh failed: {task.exception()}')
+
+
+async def _read_any(read: Callable[[], Awaitable[Cached | None]]) -> bytes | None:
+    cached = await read()
+    return cached[0] if cached else None
+
+
+async def _read_fresh(read: Callable[[], Awaitable[Cached | None]]) -> bytes | None:
+    """Под блокировкой обновление пропускается, только если другой воркер уже обновил значение."""
+    cached = await read()
+    return cached[0] if cached and not cached[1] else None
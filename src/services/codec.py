@@ -0,0 +1,102 @@
+import struct
+import time
+
+import orjson
+
+from src.core.config import settings
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# Версия формата значений в кеше. Значения неизвестной версии считаются промахом, поэтому при смене формата
+# новую версию сначала учат читать все воркеры, и только потом включают её запись.
+CODEC_VERSION = 1
+
+# Заголовок: версия, формат и сжатие тела, момент устаревания значения (0 — не устаревает)
+HEADER = struct.Struct('>BBBQ')
+
+FORMATS = {'json': 0, 'msgpack': 1}
+COMPRESSIONS = {'none': 0, 'zstd': 1, 'lz4': 2}
+
+
+class CacheCodec:
+    """
+    Кодирует значения кеша — готовые JSON-ответы — для хранения в Redis.
+
+    Тело хранится как есть (json) или перекодированным в msgpack и сжимается, если оно больше порога.
+    Декодирование всегда возвращает JSON-ответ, который можно отдать клиенту без изменений.
+    """
+
+    def __init__(self, data_format: str = 'json', compression: str = 'none', threshold: int = 0):
+        if data_format == 'msgpack' and msgpack is None:
+            raise RuntimeError('msgpack is not installed')
+        if compression == 'zstd' and zstandard is None:
+            raise RuntimeError('zstandard is not installed')
+        if compression == 'lz4' and lz4 is None:
+            raise RuntimeError('lz4 is not installed')
+        self.data_format = FORMATS[data_format]
+        self.compression = COMPRESSIONS[compression]
+        self.threshold = threshold
+        self._zstd_compressor = zstandard.ZstdCompressor() if zstandard else None
+        self._zstd_decompressor = zstandard.ZstdDecompressor() if zstandard else None
+
+    def encode(self, data: bytes, soft_ttl: int | None = None) -> bytes:
+        """
+        Кодирует JSON-ответ.
+
+        :param soft_ttl: Через сколько секунд значение считается устаревшим; без него значение не устаревает.
+        """
+        if self.data_format == FORMATS['msgpack']:
+            data = msgpack.packb(orjson.loads(data))
+        compression = self.compression if len(data) > self.threshold else COMPRESSIONS['none']
+        if compression == COMPRESSIONS['zstd']:
+            data = self._zstd_compressor.compress(data)
+        elif compression == COMPRESSIONS['lz4']:
+            data = lz4.frame.compress(data)
+        deadline = int(time.time() + soft_ttl) if soft_ttl else 0
+        return HEADER.pack(CODEC_VERSION, self.data_format, compression, deadline) + data
+
+    def decode(self, value: bytes | None) -> tuple[bytes, bool] | None:
+        """
+        Декодирует значение из Redis.
+
+        :return: JSON-ответ и признак того, что он устарел, или None, если значение нельзя прочитать.
+        """
+        if not value or len(value) < HEADER.size:
+            return None
+        version, data_format, compression, deadline = HEADER.unpack_from(value)
+        if version != CODEC_VERSION:
+            return None
+        data = value[HEADER.size:]
+        if compression == COMPRESSIONS['zstd']:
+            if zstandard is None:
+                return None
+            data = self._zstd_decompressor.decompress(data)
+        elif compression == COMPRESSIONS['lz4']:
+            if lz4 is None:
+                return None
+            data = lz4.frame.decompress(data)
+        elif compression != COMPRESSIONS['none']:
+            return None
+        if data_format == FORMATS['msgpack']:
+            if msgpack is None:
+                return None
+            data = orjson.dumps(msgpack.unpackb(data))
+        elif data_format != FORMATS['json']:
+            return None
+        return data, 0 < deadline < time.time()
+
+
+codec = CacheCodec(settings.cache_codec, settings.cache_compression, settings.cache_compression_threshold)
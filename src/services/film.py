@@ -1,15 +1,31 @@
+import uuid
 from functools import lru_cache
+from typing import AsyncIterator
+
 from fastapi import Depends
 from orjson import orjson
 
+from src.core.config import settings
 from src.db.elastic import get_elastic
 from src.db.redis import get_redis
 from elasticsearch import AsyncElasticsearch, NotFoundError
 from redis.asyncio import Redis
 from src.models.film import Film, FilmPreview
-from src.services.utils import get_key_by_args
-
-FILM_CACHE_EXPIRE_IN_SECONDS = 60 * 5  # 5 минут
+from src.services.cache import Cached, get_or_fetch, unwrap, wrap
+from src.services.genre import GenreService
+from src.services.local_cache import local_cache
+from src.services.pagination import get_sort, is_snapshot, pack_page, scan, search_page, unpack_page
+from src.services.query_builder import QueryBuilder
+from src.services.tags import set_tagged
+from src.services.utils import get_key_by_args, get_source_includes
+
+# Фильмы сбрасываются из кеша по событиям ETL, а списки — ещё и когда меняется фильм из списка.
+# Новый фильм, попавший в список, виден только после истечения срока жизни списка.
+FILM_CACHE_EXPIRE_IN_SECONDS = settings.cache_entity_expire
+FILMS_CACHE_EXPIRE_IN_SECONDS = settings.cache_list_expire
+# После мягкого срока жизни значение ещё отдаётся, но обновляется в фоне
+FILM_CACHE_SOFT_TTL = settings.cache_entity_soft_ttl
+FILMS_CACHE_SOFT_TTL = settings.cache_list_soft_ttl
 
 
 class FilmService:
@@ -17,99 +33,125 @@ class FilmService:
         self.redis = redis
         self.elastic = elastic
 
-    async def get_by_id(self, film_id: str) -> Film | None:
-        film = await self._film_from_cache(film_id)
+    async def get_by_id(self, film_id: str) -> bytes | None:
+        return await get_or_fetch(
+            f'film: {film_id}',
+            lambda: self._film_from_cache(film_id),
+            lambda: self._fetch_film(film_id),
+            self.redis,
+        )
+
+    async def all(self, **kwargs) -> tuple[bytes, str | None]:
+        films = await get_or_fetch(
+            f'films: {await get_key_by_args(**kwargs)}',
+            lambda: self._films_from_cache(**kwargs),
+            lambda: self._fetch_films(**kwargs),
+            self.redis,
+        )
+        return unpack_page(films)
+
+    async def export(self, fields: list[str]) -> AsyncIterator[bytes]:
+        """Выгружает все фильмы в формате NDJSON, по куску на пачку документов. Кеш не используется."""
+        async for hits in scan(self.elastic, 'movies', {'match_all': {}}, settings.export_batch_size, fields):
+            yield b''.join(orjson.dumps(doc['_source']) + b'\n' for doc in hits)
+
+    async def refresh_list(self, **kwargs) -> bool:
+        """
+        Перезаписывает страницу списка фильмов в кеше без жёсткого срока жизни.
+
+        Мягкий срок жизни остаётся: если страницу долго не пересчитывали, её обновит первый же запрос.
+
+        :return: True, если за страницей есть следующая.
+        """
+        films, next_cursor = await self._get_films_from_elastic(**kwargs)
+        data = pack_page(orjson.dumps([film.model_dump() for film in films]), next_cursor)
+        # готовые списки не попадают в теги: при изменениях они пересчитываются целиком
+        await self._put_films_to_cache(data, films_id=[], expire=None, soft_ttl=settings.hot_lists_soft_ttl,
+                                       **kwargs)
+        return next_cursor is not None
+
+    async def _fetch_film(self, film_id: str) -> bytes | None:
+        film = await self._get_film_from_elastic(film_id)
         if not film:
-            film = await self._get_film_from_elastic(film_id)
-            if not film:
-                return None
-            await self._put_film_to_cache(film)
-
-        return film
-
-    async def all(self, **kwargs) -> list[FilmPreview]:
-        films = await self._films_from_cache(**kwargs)
-        if not films:
-            films = await self._get_films_from_elastic(**kwargs)
-            if not films:
-                return []
-            await self._put_films_to_cache(films, **kwargs)
-        return films
+            return None
+        data = orjson.dumps(film.model_dump())
+        await self._put_film_to_cache(film_id, data)
+        return data
+
+    async def _fetch_films(self, **kwargs) -> bytes:
+        films, next_cursor = await self._get_films_from_elastic(**kwargs)
+        data = pack_page(orjson.dumps([film.model_dump() for film in films]), next_cursor)
+        if films and not is_snapshot(kwargs.get('cursor'), kwargs.get('snapshot', False)):
+            await self._put_films_to_cache(data, films_id=[film.id for film in films], **kwargs)
+        return data
 
     async def _get_film_from_elastic(self, film_id: str) -> Film | None:
         try:
-            doc = await self.elastic.get(index='movies', id=film_id)
+            doc = await self.elastic.get(index='movies', id=film_id, source_includes=get_source_includes(Film))
         except NotFoundError:
             return None
         source = doc['_source']
         return Film(**source)
 
-    async def _get_films_from_elastic(self, **kwargs) -> list[FilmPreview] | None:
+    async def _get_films_from_elastic(self, **kwargs) -> tuple[list[FilmPreview], str | None]:
         page_size = kwargs.get('page_size', 10)
         page = kwargs.get('page', 1)
         sort = kwargs.get('sort', '')
-        genre = kwargs.get('genre', None)
-        query = kwargs.get('query', None)
-        body = {"query": {"bool": {"must": []}}}
-
-        if genre:
-            body["query"]["bool"]["must"].append({
-                "match": {
-                    "genres": genre
-                }
-            })
-
-        if query:
-            body["query"]["bool"]["must"].append({
-                "match": {
-                    "title": {
-                        "query": query,
-                        "fuzziness": 1,
-                        "operator": "and"
-                    }
-                }
-            })
-
-        # Если нет условий для must, устанавливаем match_all
-        if not body["query"]["bool"]["must"]:
-            body["query"] = {"match_all": {}}
-
-        try:
-            docs = await self.elastic.search(index='movies',
-                                             body=body,
-                                             params={
-                                                 'size': page_size,
-                                                 'from': (page - 1) * page_size,
-                                                 'sort': sort,
-                                             })
-        except NotFoundError:
-            return None
-
-        return [FilmPreview(**doc['_source']) for doc in docs['hits']['hits']]
-
-    async def _film_from_cache(self, film_id: str) -> Film | None:
+        genres = kwargs.get('genre', None)
+        query = (
+            QueryBuilder()
+            .match('title', kwargs.get('query', None), fuzziness=1, operator='and')
+            .terms('genres', await self._get_genre_names(genres) if genres else None)
+            .range('imdb_rating', gte=kwargs.get('rating_from', None), lte=kwargs.get('rating_to', None))
+            .nested_term(['actors', 'writers', 'directors'], 'id', kwargs.get('person', None))
+            .build()
+        )
+        hits, next_cursor = await search_page(
+            self.elastic, 'movies', query, get_sort(sort, 'id'), page_size, page,
+            cursor=kwargs.get('cursor'), snapshot=kwargs.get('snapshot', False),
+            source_includes=get_source_includes(FilmPreview),
+        )
+        return [FilmPreview(**doc['_source']) for doc in hits], next_cursor
+
+    async def _get_genre_names(self, genres: list[str]) -> list[str]:
+        """Жанры можно указать по id или по названию, а в индексе фильмов они хранятся названиями."""
+        names, genre_ids = [], []
+        for genre in genres:
+            try:
+                uuid.UUID(genre)
+            except ValueError:
+                names.append(genre)
+            else:
+                genre_ids.append(genre)
+        if genre_ids:
+            genre_service = GenreService(self.redis, self.elastic)
+            names.extend(orjson.loads(data)['name'] for data in await genre_service.get_by_ids(genre_ids))
+        return names
+
+    async def _film_from_cache(self, film_id: str) -> Cached | None:
         key = f'film: {film_id}'
-        data = await self.redis.get(key)
-        if not data:
-            return None
-        film = Film.parse_raw(data)
-        return film
-
-    async def _films_from_cache(self, **kwargs) -> list[FilmPreview] | None:
+        data = local_cache.get(key)
+        if data:
+            return data, False
+        cached = unwrap(await self.redis.get(key))
+        if cached and not cached[1]:
+            local_cache.set(key, cached[0])
+        return cached
+
+    async def _films_from_cache(self, **kwargs) -> Cached | None:
         key = f'films: {await get_key_by_args(**kwargs)}'
-        data = await self.redis.get(key)
-        if not data:
-            return None
-
-        return [FilmPreview.parse_raw(item) for item in orjson.loads(data)]
+        return unwrap(await self.redis.get(key))
 
-    async def _put_film_to_cache(self, film: Film):
-        key = f'film: {film.id}'
-        await self.redis.set(key, film.json(), FILM_CACHE_EXPIRE_IN_SECONDS)
+    async def _put_film_to_cache(self, film_id: str, data: bytes):
+        key = f'film: {film_id}'
+        await self.redis.set(key, wrap(data, FILM_CACHE_SOFT_TTL), FILM_CACHE_EXPIRE_IN_SECONDS)
+        local_cache.set(key, data)
 
-    async def _put_films_to_cache(self, films: list[FilmPreview], **kwargs):
+    async def _put_films_to_cache(self, data: bytes, films_id: list[str],
+                                  expire: int | None = FILMS_CACHE_EXPIRE_IN_SECONDS,
+                                  soft_ttl: int | None = FILMS_CACHE_SOFT_TTL, **kwargs):
         key = f'films: {await get_key_by_args(**kwargs)}'
-        await self.redis.set(key, orjson.dumps([film.json() for film in films]), FILM_CACHE_EXPIRE_IN_SECONDS)
+        await set_tagged(self.redis, key, wrap(data, soft_ttl), expire, {'movies': films_id})
 
 
 @lru_cache()
@@ -2,14 +2,24 @@ from functools import lru_cache
 
 import orjson
 from fastapi import Depends
+from src.core.config import settings
 from src.db.elastic import get_elastic
 from src.db.redis import get_redis
 from elasticsearch import AsyncElasticsearch, NotFoundError
 from redis.asyncio import Redis
 from src.models.genre import Genre
-from src.services.utils import get_key_by_args
+from src.services.cache import Cached, get_or_fetch, unwrap, wrap
+from src.services.local_cache import local_cache
+from src.services.pagination import get_sort, is_snapshot, pack_page, search_page, unpack_page
+from src.services.tags import set_tagged
+from src.services.utils import get_key_by_args, get_source_includes
 
-GENRE_CACHE_EXPIRE_IN_SECONDS = 60 * 5  # 5 минут
+# Жанры сбрасываются из кеша по событиям ETL, списки — когда меняется жанр из списка
+GENRE_CACHE_EXPIRE_IN_SECONDS = settings.cache_entity_expire
+GENRES_CACHE_EXPIRE_IN_SECONDS = settings.cache_list_expire
+# После мягкого срока жизни значение ещё отдаётся, но обновляется в фоне
+GENRE_CACHE_SOFT_TTL = settings.cache_entity_soft_ttl
+GENRES_CACHE_SOFT_TTL = settings.cache_list_soft_ttl
 
 
 class GenreService:
@@ -17,70 +27,97 @@ class GenreService:
         self.redis = redis
         self.elastic = elastic
 
-    async def get_by_id(self, genre_id: str) -> Genre | None:
-        genre = await self._genre_from_cache(genre_id)
-        if not genre:
-            genre = await self._get_genre_from_elastic(genre_id)
-            if not genre:
-                return None
-            await self._put_genre_to_cache(genre)
+    async def get_by_id(self, genre_id: str) -> bytes | None:
+        return await get_or_fetch(
+            f'genre: {genre_id}',
+            lambda: self._genre_from_cache(genre_id),
+            lambda: self._fetch_genre(genre_id),
+            self.redis,
+        )
+
+    async def get_by_ids(self, genre_ids: list[str]) -> list[bytes]:
+        """
+        Отдаёт найденные жанры по списку id.
 
-        return genre
+        Свежие значения читаются из кеша одним MGET, остальные — по одному через get_by_id.
+        """
+        genres = {genre_id: local_cache.get(f'genre: {genre_id}') for genre_id in genre_ids}
+        missing = [genre_id for genre_id, data in genres.items() if not data]
+        if missing:
+            values = await self.redis.mget([f'genre: {genre_id}' for genre_id in missing])
+            for genre_id, value in zip(missing, values):
+                cached = unwrap(value)
+                if cached and not cached[1]:
+                    genres[genre_id] = cached[0]
+                    local_cache.set(f'genre: {genre_id}', cached[0])
+                else:
+                    genres[genre_id] = await self.get_by_id(genre_id)
+        return [data for data in genres.values() if data]
+
+    async def _fetch_genre(self, genre_id: str) -> bytes | None:
+        genre = await self._get_genre_from_elastic(genre_id)
+        if not genre:
+            return None
+        data = orjson.dumps(genre.model_dump())
+        await self._put_genre_to_cache(genre_id, data)
+        return data
 
     async def _get_genre_from_elastic(self, genre_id) -> Genre | None:
         try:
-            doc = await self.elastic.get(index='genres', id=genre_id)
+            doc = await self.elastic.get(index='genres', id=genre_id, source_includes=get_source_includes(Genre))
         except NotFoundError:
             return None
         return Genre(**doc['_source'])
     
-    async def _get_genres_from_elastic(self, **kwargs) -> Genre | None:
+    async def _get_genres_from_elastic(self, **kwargs) -> tuple[list[Genre], str | None]:
         page_size = kwargs.get('page_size', 10)
         page = kwargs.get('page', 1)
-        body = {"query":  {"match_all": {}}}
-        try:
-            docs = await self.elastic.search(index='genres',
-                                             body=body,
-                                             params={
-                                                 'size': page_size,
-                                                 'from': (page - 1) * page_size,
-                                             })
-        except NotFoundError:
-            return None
+        hits, next_cursor = await search_page(
+            self.elastic, 'genres', {"match_all": {}}, get_sort(None, 'id'), page_size, page,
+            cursor=kwargs.get('cursor'), snapshot=kwargs.get('snapshot', False),
+            source_includes=get_source_includes(Genre),
+        )
+        return [Genre(**doc['_source']) for doc in hits], next_cursor
 
-        return [Genre(**doc['_source']) for doc in docs['hits']['hits']]
+    async def _genre_from_cache(self, genre_id: str) -> Cached | None:
+        key = f'genre: {genre_id}'
+        data = local_cache.get(key)
+        if data:
+            return data, False
+        cached = unwrap(await self.redis.get(key))
+        if cached and not cached[1]:
+            local_cache.set(key, cached[0])
+        return cached
 
-    async def _genre_from_cache(self, genre_id: str) -> Genre | None:
+    async def _put_genre_to_cache(self, genre_id: str, data: bytes):
         key = f'genre: {genre_id}'
-        data = await self.redis.get(key)
-        if not data:
-            return None
-        genre = Genre.model_validate_json(data)
-        return genre
-
-    async def _put_genre_to_cache(self, genre: Genre):
-        key = f'genre: {genre.id}'
-        await self.redis.set(key, genre.model_dump_json(), GENRE_CACHE_EXPIRE_IN_SECONDS)
-
-    async def all(self, **kwargs) -> list[Genre]:
-        genres = await self._genres_from_cache(**kwargs)
-        if not genres:
-            genres = await self._get_genres_from_elastic(**kwargs)
-            if not genres:
-                return []
-            await self._put_genres_to_cache(genres, **kwargs)
-        return genres
-
-    async def _genres_from_cache(self, **kwargs) -> list[Genre]| None: 
+        await self.redis.set(key, wrap(data, GENRE_CACHE_SOFT_TTL), GENRE_CACHE_EXPIRE_IN_SECONDS)
+        local_cache.set(key, data)
+
+    async def all(self, **kwargs) -> tuple[bytes, str | None]:
+        genres = await get_or_fetch(
+            f'genres: {await get_key_by_args(**kwargs)}',
+            lambda: self._genres_from_cache(**kwargs),
+            lambda: self._fetch_genres(**kwargs),
+            self.redis,
+        )
+        return unpack_page(genres)
+
+    async def _fetch_genres(self, **kwargs) -> bytes:
+        genres, next_cursor = await self._get_genres_from_elastic(**kwargs)
+        data = pack_page(orjson.dumps([genre.model_dump() for genre in genres]), next_cursor)
+        if genres and not is_snapshot(kwargs.get('cursor'), kwargs.get('snapshot', False)):
+            await self._put_genres_to_cache(data, [genre.id for genre in genres], **kwargs)
+        return data
+
+    async def _genres_from_cache(self, **kwargs) -> Cached | None:
         key = f'genres: {await get_key_by_args(**kwargs)}'
-        data = await self.redis.get(key)
-        if not data:
-            return None
-        return [Genre.model_validate_json(item) for item in orjson.loads(data)]
+        return unwrap(await self.redis.get(key))
 
-    async def _put_genres_to_cache(self, genres: list[Genre], **kwargs):
+    async def _put_genres_to_cache(self, data: bytes, genres_id: list[str], **kwargs):
         key = f'genres: {await get_key_by_args(**kwargs)}'
-        await self.redis.set(key, orjson.dumps([genre.model_dump_json() for genre in genres]), GENRE_CACHE_EXPIRE_IN_SECONDS)
+        await set_tagged(self.redis, key, wrap(data, GENRES_CACHE_SOFT_TTL), GENRES_CACHE_EXPIRE_IN_SECONDS,
+                         {'genres': genres_id})
 
 @lru_cache()
 def get_genre_service(
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import time
+
+from elastic_transport import TransportError
+from elasticsearch import ApiError, AsyncElasticsearch
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from src.core.config import settings
+from src.services.film import FilmService
+from src.services.invalidation import add_listener
+from src.services.pagination import scan
+from src.services.utils import get_key_by_args
+
+logger = logging.getLogger(__name__)
+
+# Множество ключей кеша с готовыми списками, чтобы удалять списки исчезнувших жанров
+HOT_LISTS_KEY = 'hot_lists'
+# Время начала последнего обновления: по нему воркеры не повторяют обновление, уже сделанное другим воркером
+HOT_LISTS_REFRESHED_AT_KEY = 'hot_lists: refreshed_at'
+HOT_LISTS_LOCK_TIMEOUT = 60
+
+
+def get_list_kwargs(page: int, sort: str, genre: str | None) -> dict:
+    """
+    Параметры FilmService.all для страницы списка фильмов без фильтров, кроме жанра.
+
+    Должны совпадать с тем, что передаёт обработчик /api/v1/films/, иначе запросы не попадут в готовые списки.
+    """
+    return {
+        'page_size': settings.hot_lists_page_size,
+        'page': page,
+        'sort': sort,
+        'genre': [genre] if genre else None,
+        'rating_from': None,
+        'rating_to': None,
+        'person': None,
+        'cursor': None,
+        'snapshot': False,
+    }
+
+
+class HotLists:
+    """
+    Держит в Redis первые страницы самых частых списков фильмов: общего и по каждому жанру.
+
+    Страницы хранятся без жёсткого срока жизни под теми же ключами, что читает FilmService, и пересчитываются,
+    когда ETL сообщает об изменениях фильмов или жанров. На случай потерянного события они пересчитываются
+    и по таймеру, вдвое чаще, чем истекает их мягкий срок жизни.
+    """
+
+    def __init__(self, redis: Redis, elastic: AsyncElasticsearch):
+        self.redis = redis
+        self.elastic = elastic
+        self.film_service = FilmService(redis, elastic)
+        self._changed = asyncio.Event()
+        self._changed_at = 0.0
+
+    def on_change(self, change: dict | None) -> None:
+        if change is None or change['index'] in ('movies', 'genres'):
+            self._changed_at = time.time()
+            self._changed.set()
+
+    async def run(self) -> None:
+        add_listener(self.on_change)
+        self.on_change(None)
+        interval = settings.hot_lists_soft_ttl / 2
+        while True:
+            try:
+                await asyncio.wait_for(self._changed.wait(), interval)
+            except TimeoutError:
+                # пересчёт по таймеру пропускается, если другой воркер уже пересчитал списки за этот интервал
+                self._changed_at = max(self._changed_at, time.time() - interval)
+            else:
+                # изменения приходят пачками по чанкам ETL, поэтому список пересчитывается после паузы
+                await asyncio.sleep(settings.hot_lists_refresh_delay)
+            self._changed.clear()
+            try:
+                await self.refresh(self._changed_at)
+            except (ApiError, TransportError, RedisError) as error:
+                logger.warning(f'Could not refresh hot lists: {error}')
+                self._changed.set()
+
+    async def refresh(self, changed_at: float) -> None:
+        """Пересчитывает списки, если с момента изменения их ещё не пересчитал другой воркер."""
+        async with self.redis.lock(f'lock: {HOT_LISTS_KEY}', timeout=HOT_LISTS_LOCK_TIMEOUT,
+                                   blocking_timeout=HOT_LISTS_LOCK_TIMEOUT):
+            refreshed_at = await self.redis.get(HOT_LISTS_REFRESHED_AT_KEY)
+            if refreshed_at and float(refreshed_at) >= changed_at:
+                return
+            started_at = time.time()
+            keys = set()
+            for genre in [None, *await self._get_genre_names()]:
+                for sort in settings.hot_lists_sorts:
+                    for page in range(1, settings.hot_lists_pages + 1):
+                        kwargs = get_list_kwargs(page, sort, genre)
+                        keys.add(f'films: {await get_key_by_args(**kwargs)}')
+                        if not await self.film_service.refresh_list(**kwargs):
+                            break
+            stale = {key.decode() for key in await self.redis.smembers(HOT_LISTS_KEY)} - keys
+            async with self.redis.pipeline(transaction=True) as pipe:
+                if stale:
+                    pipe.delete(*stale)
+                pipe.delete(HOT_LISTS_KEY)
+                pipe.sadd(HOT_LISTS_KEY, *keys)
+                pipe.set(HOT_LISTS_REFRESHED_AT_KEY, started_at)
+                await pipe.execute()
+            logger.info(f'Refreshed {len(keys)} hot list pages')
+
+    async def _get_genre_names(self) -> list[str]:
+        names = []
+        async for hits in scan(self.elastic, 'genres', {'match_all': {}}, settings.export_batch_size, ['name']):
+            names.extend(hit['_source']['name'] for hit in hits)
+        return names
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+from typing import Callable
+
+import orjson
+from redis.asyncio import Redis
+from redis.exceptions import ConnectionError, TimeoutError
+
+from src.core.config import settings
+from src.services.local_cache import local_cache
+from src.services.tags import invalidate_tags
+
+logger = logging.getLogger(__name__)
+
+# Префиксы ключей кеша с документами индекса
+INDEX_KEY_PREFIXES = {
+    'movies': ['film: ', 'film_preview: '],
+    'genres': ['genre: '],
+    'persons': ['person: '],
+}
+
+# Список сообщений, которые ETL опубликовал, когда ни один воркер не был подписан на канал
+MISSED_KEY = f'{settings.cache_invalidation_channel}: missed'
+
+# Обработчики изменений из канала; None означает, что часть изменений могла быть потеряна
+_listeners: list[Callable[[dict | None], None]] = []
+
+
+def add_listener(listener: Callable[[dict | None], None]) -> None:
+    _listeners.append(listener)
+
+
+async def listen_invalidations(redis: Redis) -> None:
+    """
+    Слушает канал, в который ETL публикует id изменённых документов, и сбрасывает их в кеше.
+
+    Из Redis удаляются ключи самих документов и списки, в которые они попали. Сообщение получает каждый
+    воркер, удаление повторяется, но от этого ничего не ломается. После потери соединения кеш первого
+    уровня очищается целиком: сообщения, которые получили другие воркеры, уже применены к Redis.
+    Сообщения, которые не получил никто, ETL сохраняет отдельно, и они применяются после каждой подписки.
+    Сообщение, которое не удалось применить, считается потерянным, а слушатель продолжает работу.
+    """
+    while True:
+        pubsub = redis.pubsub()
+        try:
+            await pubsub.subscribe(settings.cache_invalidation_channel)
+            # пропущенные сообщения читаются только после подтверждения подписки, иначе опубликованное
+            # между ними не попадёт ни в канал, ни в список
+            while await pubsub.get_message(ignore_subscribe_messages=False,
+                                           timeout=settings.redis_health_check_interval or 1) is None:
+                pass
+            await _apply_missed(redis)
+            while True:
+                # ожидание ограничено, чтобы не упереться в таймаут сокета и успевать проверять соединение
+                message = await pubsub.get_message(ignore_subscribe_messages=True,
+                                                   timeout=settings.redis_health_check_interval or 1)
+                if message is None:
+                    continue
+                await _apply(redis, message['data'])
+        except Exception as error:
+            if isinstance(error, (ConnectionError, TimeoutError)):
+                logger.warning(f'Cache invalidation channel is unavailable: {error}')
+            else:
+                logger.exception(f'Cache invalidation listener failed: {error}')
+            local_cache.clear()
+            _notify(None)
+            await asyncio.sleep(1)
+        finally:
+            await pubsub.aclose()
+
+
+async def invalidate(redis: Redis, change: dict) -> None:
+    prefixes = INDEX_KEY_PREFIXES.get(change['index'])
+    if prefixes is None:
+        return
+    keys = [f'{prefix}{doc_id}' for prefix in prefixes for doc_id in change['ids']]
+    for key in keys:
+        local_cache.delete(key)
+    await invalidate_tags(redis, change['index'], change['ids'], keys)
+
+
+async def _apply(redis: Redis, data: bytes) -> None:
+    try:
+        change = orjson.loads(data)
+        await invalidate(redis, change)
+    except (ConnectionError, TimeoutError):
+        raise
+    except Exception:
+        logger.exception(f'Could not apply cache invalidation {data!r}')
+        local_cache.clear()
+        change = None
+    _notify(change)
+
+
+async def _apply_missed(redis: Redis) -> None:
+    """Применяет сообщения, опубликованные, пока ни один воркер не был подписан. Их забирает один воркер."""
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.lrange(MISSED_KEY, 0, -1)
+        pipe.delete(MISSED_KEY)
+        messages, _ = await pipe.execute()
+    if messages:
+        logger.info(f'Applying {len(messages)} missed cache invalidations')
+    for data in messages:
+        await _apply(redis, data)
+
+
+def _notify(change: dict | None) -> None:
+    for listener in _listeners:
+        try:
+            listener(change)
+        except Exception:
+            logger.exception('Cache invalidation listener failed')
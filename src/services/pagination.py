@@ -0,0 +1,176 @@
+import base64
+import binascii
+from typing import AsyncIterator
+
+import orjson
+from elasticsearch import AsyncElasticsearch, NotFoundError
+
+from src.core.config import settings
+
+
+class InvalidCursorError(ValueError):
+    """Курсор пагинации повреждён или не подходит к запросу."""
+
+
+def get_sort(sort: str | None, tiebreaker: str) -> list[dict]:
+    """
+    Собирает сортировку Elasticsearch из параметра запроса.
+
+    `-field` или `field:desc` сортируют по убыванию. Последним всегда добавляется уникальное поле,
+    чтобы порядок был однозначным и по нему можно было продолжить выборку через search_after.
+    """
+    result = []
+    if sort:
+        field, _, order = sort.partition(':')
+        if field.startswith('-'):
+            field, order = field[1:], 'desc'
+        if field != tiebreaker:
+            result.append({field: order or 'asc'})
+    result.append({tiebreaker: 'asc'})
+    return result
+
+
+def encode_cursor(sort: list[dict], search_after: list, pit_id: str | None = None) -> str:
+    cursor = {'sort': sort, 'search_after': search_after}
+    if pit_id:
+        cursor['pit'] = pit_id
+    return base64.urlsafe_b64encode(orjson.dumps(cursor)).decode()
+
+
+def decode_cursor(cursor: str, sort: list[dict]) -> dict:
+    """
+    Разбирает курсор и проверяет, что он выдан для той же сортировки.
+
+    :raises: InvalidCursorError
+    """
+    try:
+        data = orjson.loads(base64.urlsafe_b64decode(cursor))
+    except (binascii.Error, ValueError):
+        raise InvalidCursorError('invalid cursor')
+    if not isinstance(data, dict) or not isinstance(data.get('search_after'), list):
+        raise InvalidCursorError('invalid cursor')
+    if data.get('sort') != sort:
+        raise InvalidCursorError('cursor was issued for a different sort order')
+    return data
+
+
+def is_snapshot(cursor: str | None, snapshot: bool) -> bool:
+    """Страницы выборки из point-in-time не кешируются: у каждого обхода свой снимок."""
+    if snapshot:
+        return True
+    if not cursor:
+        return False
+    try:
+        return 'pit' in orjson.loads(base64.urlsafe_b64decode(cursor))
+    except (binascii.Error, ValueError):
+        return False
+
+
+PAGE_ITEMS = b',"items":'
+
+
+def pack_page(body: bytes, next_cursor: str | None) -> bytes:
+    """
+    Упаковывает тело ответа вместе с курсором следующей страницы для кеша.
+
+    Страница остаётся JSON-документом, чтобы кодек кеша мог её перекодировать.
+    """
+    return b'{"next":' + orjson.dumps(next_cursor) + PAGE_ITEMS + body + b'}'
+
+
+def unpack_page(data: bytes) -> tuple[bytes, str | None]:
+    """Достаёт тело ответа без разбора JSON: в курсоре нет кавычек и запятых."""
+    head, _, body = data.partition(PAGE_ITEMS)
+    return body[:-1], orjson.loads(head[len(b'{"next":'):])
+
+
+async def search_page(
+        elastic: AsyncElasticsearch,
+        index: str,
+        query: dict,
+        sort: list[dict],
+        page_size: int,
+        page: int = 1,
+        cursor: str | None = None,
+        snapshot: bool = False,
+        source_includes: list[str] | None = None,
+) -> tuple[list[dict], str | None]:
+    """
+    Выбирает одну страницу документов.
+
+    Без курсора страница выбирается по номеру, с курсором — через search_after от последнего документа
+    предыдущей страницы. При snapshot первая страница открывает point-in-time, и весь обход идёт
+    по одному снимку индекса; снимок закрывается на последней странице. Общее число найденных
+    документов не считается: ответам оно не нужно.
+
+    :return: Найденные документы и курсор следующей страницы, если она может быть.
+    :raises: InvalidCursorError
+    """
+    body = {'query': query, 'sort': sort, 'size': page_size, 'track_total_hits': False}
+    if source_includes is not None:
+        body['_source'] = source_includes
+    pit_id = None
+    if cursor:
+        data = decode_cursor(cursor, sort)
+        body['search_after'] = data['search_after']
+        pit_id = data.get('pit')
+    else:
+        body['from'] = (page - 1) * page_size
+        if snapshot:
+            pit = await elastic.open_point_in_time(index=index, keep_alive=settings.es_pit_keep_alive)
+            pit_id = pit['id']
+    if pit_id:
+        body['pit'] = {'id': pit_id, 'keep_alive': settings.es_pit_keep_alive}
+
+    try:
+        docs = await elastic.search(index=None if pit_id else index, body=body)
+    except NotFoundError:
+        if pit_id:
+            raise InvalidCursorError('snapshot has expired')
+        return [], None
+
+    hits = docs['hits']['hits']
+    pit_id = docs.get('pit_id', pit_id)
+    if len(hits) < page_size:
+        if pit_id:
+            await elastic.close_point_in_time(id=pit_id)
+        return hits, None
+    return hits, encode_cursor(sort, hits[-1]['sort'], pit_id)
+
+
+async def scan(
+        elastic: AsyncElasticsearch,
+        index: str,
+        query: dict,
+        batch_size: int,
+        source_includes: list[str] | None = None,
+) -> AsyncIterator[list[dict]]:
+    """
+    Обходит все документы индекса пачками по одному point-in-time снимку.
+
+    В памяти одновременно держится только одна пачка. Снимок закрывается и при досрочной остановке обхода.
+    """
+    pit = await elastic.open_point_in_time(index=index, keep_alive=settings.es_pit_keep_alive)
+    pit_id = pit['id']
+    body = {
+        'query': query,
+        # _shard_doc — самый дешёвый однозначный порядок для обхода снимка
+        'sort': [{'_shard_doc': 'asc'}],
+        'size': batch_size,
+        'track_total_hits': False,
+    }
+    if source_includes is not None:
+        body['_source'] = source_includes
+    try:
+        while True:
+            body['pit'] = {'id': pit_id, 'keep_alive': settings.es_pit_keep_alive}
+            docs = await elastic.search(body=body)
+            pit_id = docs.get('pit_id', pit_id)
+            hits = docs['hits']['hits']
+            if hits:
+                yield hits
+            if len(hits) < batch_size:
+                return
+            body['search_after'] = hits[-1]['sort']
+    finally:
+        await elastic.close_point_in_time(id=pit_id)
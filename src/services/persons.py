@@ -2,16 +2,26 @@ from functools import lru_cache
 
 import orjson
 from fastapi import Depends
+from src.core.config import settings
 from src.db.elastic import get_elastic
 from src.db.redis import get_redis
 from elasticsearch import AsyncElasticsearch, NotFoundError
 from redis.asyncio import Redis
 from src.models.persons import Person
 from src.models.film import FilmPreview
-from src.services.film import FilmService
-from src.services.utils import get_key_by_args
+from src.services.cache import Cached, get_or_fetch, unwrap, wrap
+from src.services.local_cache import local_cache
+from src.services.pagination import get_sort, is_snapshot, pack_page, search_page, unpack_page
+from src.services.query_builder import QueryBuilder
+from src.services.tags import set_tagged
+from src.services.utils import get_key_by_args, get_source_includes
 
-PERSON_CACHE_EXPIRE_IN_SECONDS = 60 * 5  # 5 минут
+# Персоны и превью фильмов сбрасываются из кеша по событиям ETL, списки — когда меняется их элемент
+PERSON_CACHE_EXPIRE_IN_SECONDS = settings.cache_entity_expire
+PERSONS_CACHE_EXPIRE_IN_SECONDS = settings.cache_list_expire
+# После мягкого срока жизни значение ещё отдаётся, но обновляется в фоне
+PERSON_CACHE_SOFT_TTL = settings.cache_entity_soft_ttl
+PERSONS_CACHE_SOFT_TTL = settings.cache_list_soft_ttl
 
 
 class PersonService:
@@ -19,116 +29,140 @@ class PersonService:
         self.redis = redis
         self.elastic = elastic
 
-    async def get_films_by_person(self, person_id: str) -> list[FilmPreview] | None:
-        films = await self._films_by_person_from_cache(person_id)
+    async def get_films_by_person(self, person_id: str) -> bytes | None:
+        return await get_or_fetch(
+            f'films_by_person: {person_id}',
+            lambda: self._films_by_person_from_cache(person_id),
+            lambda: self._fetch_films_by_person(person_id),
+            self.redis,
+        )
+
+    async def _fetch_films_by_person(self, person_id: str) -> bytes | None:
+        films = await self._get_films_by_person_from_elastic(person_id)
         if not films:
-            films = await self._get_films_by_person_from_elastic(person_id)
-            if not films:
-                return None
-            await self._put_films_by_person_to_cache(person_id=person_id, films=films)
-        return films
-
-    async def _get_films_by_person_from_elastic(self, person_id: str):
-        films_by_person = []
-        app_film_service = FilmService(self.redis, self.elastic)
-        person_data = await self._get_person_from_elastic(person_id)
-        if not person_data:
             return None
-        films_id = [film['id'] for film in person_data.model_dump()['films']]
+        # превью фильмов уже сериализованы, поэтому список собирается из них без повторного разбора
+        data = b'[' + b','.join(films.values()) + b']'
+        await self._put_films_by_person_to_cache(person_id, data, list(films))
+        return data
+
+    async def _get_films_by_person_from_elastic(self, person_id: str) -> dict[str, bytes] | None:
+        person = await self.get_by_id(person_id)
+        if not person:
+            return None
+        films_id = [film['id'] for film in orjson.loads(person)['films']]
         if not films_id:
             return None
-        for id in films_id:
-            film = await app_film_service.get_by_id(id)
-            films_by_person.append(FilmPreview(**film.model_dump()))
-        return films_by_person
-
-    async def get_by_id(self, person_id: str) -> Person | None:
-        person = await self._person_from_cache(person_id)
+        films = await self._film_previews_from_cache(films_id)
+        missing = [film_id for film_id in films_id if film_id not in films]
+        if missing:
+            fetched = await self._get_film_previews_from_elastic(missing)
+            await self._put_film_previews_to_cache(fetched)
+            films.update(fetched)
+        return {film_id: films[film_id] for film_id in films_id if film_id in films}
+
+    async def _get_film_previews_from_elastic(self, films_id: list[str]) -> dict[str, bytes]:
+        docs = await self.elastic.mget(index='movies', ids=films_id, source_includes=get_source_includes(FilmPreview))
+        return {
+            doc['_id']: orjson.dumps(FilmPreview(**doc['_source']).model_dump())
+            for doc in docs['docs'] if doc.get('found')
+        }
+
+    async def _film_previews_from_cache(self, films_id: list[str]) -> dict[str, bytes]:
+        data = await self.redis.mget([f'film_preview: {film_id}' for film_id in films_id])
+        cached = {film_id: unwrap(item) for film_id, item in zip(films_id, data)}
+        return {film_id: item[0] for film_id, item in cached.items() if item}
+
+    async def _put_film_previews_to_cache(self, films: dict[str, bytes]):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for film_id, data in films.items():
+                pipe.set(f'film_preview: {film_id}', wrap(data, None), PERSON_CACHE_EXPIRE_IN_SECONDS)
+            await pipe.execute()
+
+    async def get_by_id(self, person_id: str) -> bytes | None:
+        return await get_or_fetch(
+            f'person: {person_id}',
+            lambda: self._person_from_cache(person_id),
+            lambda: self._fetch_person(person_id),
+            self.redis,
+        )
+
+    async def all(self, **kwargs) -> tuple[bytes, str | None]:
+        persons = await get_or_fetch(
+            f'persons: {await get_key_by_args(**kwargs)}',
+            lambda: self._persons_from_cache(**kwargs),
+            lambda: self._fetch_persons(**kwargs),
+            self.redis,
+        )
+        return unpack_page(persons)
+
+    async def _fetch_person(self, person_id: str) -> bytes | None:
+        person = await self._get_person_from_elastic(person_id)
         if not person:
-            person = await self._get_person_from_elastic(person_id)
-            if not person:
-                return None
-            await self._put_person_to_cache(person)
-        return person
-
-    async def all(self, **kwargs) -> list[Person]:
-        persons = await self._persons_from_cache(**kwargs)
-        if not persons:
-            persons = await self._get_persons_from_elastic(**kwargs)
-            if not persons:
-                return []
-            await self._put_persons_to_cache(persons, **kwargs)
-        return persons
+            return None
+        data = orjson.dumps(person.model_dump())
+        await self._put_person_to_cache(person_id, data)
+        return data
+
+    async def _fetch_persons(self, **kwargs) -> bytes:
+        persons, next_cursor = await self._get_persons_from_elastic(**kwargs)
+        data = pack_page(orjson.dumps([person.model_dump() for person in persons]), next_cursor)
+        if persons and not is_snapshot(kwargs.get('cursor'), kwargs.get('snapshot', False)):
+            await self._put_persons_to_cache(data, [person.person_id for person in persons], **kwargs)
+        return data
 
     async def _get_person_from_elastic(self, person_id) -> Person | None:
         try:
-            doc = await self.elastic.get(index='persons', id=person_id)
+            doc = await self.elastic.get(index='persons', id=person_id, source_includes=get_source_includes(Person))
         except NotFoundError:
             return None
         return Person(**doc['_source'])
     
-    async def _get_persons_from_elastic(self, **kwargs) -> list[Person] | None:
+    async def _get_persons_from_elastic(self, **kwargs) -> tuple[list[Person], str | None]:
         page_size = kwargs.get('page_size', 10)
         page = kwargs.get('page', 1)
         query = kwargs.get('query', None)
-        body = {"query": {"bool": {"must": []}}}
-        if query:
-            body["query"]["bool"]["must"].append({
-                "match": {
-                    "full_name": {
-                        "query": query,
-                        "fuzziness": 1,
-                        "operator": "and"
-                    }
-                }
-            })
-        if not body["query"]["bool"]["must"]:
-            body["query"] = {"match_all": {}}
-        try:
-            docs = await self.elastic.search(index='persons',
-                                             body=body,
-                                             params={
-                                                 'size': page_size,
-                                                 'from': (page - 1) * page_size,
-                                             })
-        except NotFoundError:
-            return None
-
-        return [Person(**doc['_source']) for doc in docs['hits']['hits']]
-
-    async def _put_person_to_cache(self, person: Person):
-        key = f'person: {person.person_id}'
-        await self.redis.set(key, person.json(), PERSON_CACHE_EXPIRE_IN_SECONDS)
+        search = QueryBuilder().match('full_name', query, fuzziness=1, operator='and').build()
+        # при поиске по имени сначала идут самые релевантные персоны
+        hits, next_cursor = await search_page(
+            self.elastic, 'persons', search, get_sort('-_score' if query else None, 'person_id.keyword'),
+            page_size, page, cursor=kwargs.get('cursor'), snapshot=kwargs.get('snapshot', False),
+            source_includes=get_source_includes(Person),
+        )
+        return [Person(**doc['_source']) for doc in hits], next_cursor
+
+    async def _put_person_to_cache(self, person_id: str, data: bytes):
+        key = f'person: {person_id}'
+        await self.redis.set(key, wrap(data, PERSON_CACHE_SOFT_TTL), PERSON_CACHE_EXPIRE_IN_SECONDS)
+        local_cache.set(key, data)
 
-    async def _put_persons_to_cache(self, persons: list[Person], **kwargs):
+    async def _put_persons_to_cache(self, data: bytes, persons_id: list[str], **kwargs):
         key = f'persons: {await get_key_by_args(**kwargs)}'
-        await self.redis.set(key, orjson.dumps([person.json() for person in persons]), PERSON_CACHE_EXPIRE_IN_SECONDS)
+        await set_tagged(self.redis, key, wrap(data, PERSONS_CACHE_SOFT_TTL), PERSONS_CACHE_EXPIRE_IN_SECONDS,
+                         {'persons': persons_id})
 
-    async def _person_from_cache(self, person_id: str) -> Person | None:
+    async def _person_from_cache(self, person_id: str) -> Cached | None:
         key = f'person: {person_id}'
-        data = await self.redis.get(key)
-        if not data:
-            return None
-        person = Person.parse_raw(data)
-        return person
-
-    async def _persons_from_cache(self, **kwargs) -> list[Person] | None:
+        data = local_cache.get(key)
+        if data:
+            return data, False
+        cached = unwrap(await self.redis.get(key))
+        if cached and not cached[1]:
+            local_cache.set(key, cached[0])
+        return cached
+
+    async def _persons_from_cache(self, **kwargs) -> Cached | None:
         key = f'persons: {await get_key_by_args(**kwargs)}'
-        data = await self.redis.get(key)
-        if not data:
-            return None
-        return [Person.parse_raw(item) for item in orjson.loads(data)]
+        return unwrap(await self.redis.get(key))
 
-    async def _put_films_by_person_to_cache(self, person_id: str, films: list[FilmPreview], **kwargs):
+    async def _put_films_by_person_to_cache(self, person_id: str, data: bytes, films_id: list[str]):
         key = f'films_by_person: {person_id}'
-        await self.redis.set(key, orjson.dumps([film.json() for film in films]), PERSON_CACHE_EXPIRE_IN_SECONDS)
+        await set_tagged(self.redis, key, wrap(data, PERSONS_CACHE_SOFT_TTL), PERSONS_CACHE_EXPIRE_IN_SECONDS,
+                         {'persons': [person_id], 'movies': films_id})
 
-    async def _films_by_person_from_cache(self, *args, **kwargs) -> list[FilmPreview] | None:
-        key = f'films_by_person: {args[0]}'
-        data = await self.redis.get(key)
-        if not data:
-            return None
-        return [FilmPreview.parse_raw(item) for item in orjson.loads(data)]
+    async def _films_by_person_from_cache(self, person_id: str) -> Cached | None:
+        key = f'films_by_person: {person_id}'
+        return unwrap(await self.redis.get(key))
 
 
 @lru_cache()
@@ -0,0 +1,51 @@
+from typing import Self
+
+
+class QueryBuilder:
+    """
+    Собирает bool-запрос Elasticsearch.
+
+    Полнотекстовый поиск попадает в must и влияет на релевантность. Точные условия попадают в filter:
+    Elasticsearch не считает для них релевантность и кеширует их результаты между запросами.
+    """
+
+    def __init__(self):
+        self._must: list[dict] = []
+        self._filter: list[dict] = []
+
+    def match(self, field: str, text: str | None, **params) -> Self:
+        """Полнотекстовый поиск по полю, влияющий на релевантность."""
+        if text:
+            self._must.append({'match': {field: {'query': text, **params}}})
+        return self
+
+    def terms(self, field: str, values: list[str] | None) -> Self:
+        """Поле совпадает с любым из значений."""
+        if values is not None:
+            self._filter.append({'terms': {field: values}})
+        return self
+
+    def range(self, field: str, gte: float | None = None, lte: float | None = None) -> Self:
+        bounds = {key: value for key, value in (('gte', gte), ('lte', lte)) if value is not None}
+        if bounds:
+            self._filter.append({'range': {field: bounds}})
+        return self
+
+    def nested_term(self, paths: list[str], field: str, value: str | None) -> Self:
+        """Поле вложенного объекта совпадает со значением хотя бы в одном из перечисленных вложенных полей."""
+        if value:
+            self._filter.append({'bool': {'should': [
+                {'nested': {'path': path, 'query': {'term': {f'{path}.{field}': value}}}}
+                for path in paths
+            ], 'minimum_should_match': 1}})
+        return self
+
+    def build(self) -> dict:
+        if not self._must and not self._filter:
+            return {'match_all': {}}
+        query = {}
+        if self._must:
+            query['must'] = self._must
+        if self._filter:
+            query['filter'] = self._filter
+        return {'bool': query}
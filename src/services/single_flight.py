@@ -0,0 +1,64 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, TypeVar
+
+from redis.asyncio import Redis
+from redis.exceptions import LockError
+
+from src.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# Запросы к Elasticsearch, которые сейчас выполняются в этом воркере, по ключу кеша
+_flights: dict[str, asyncio.Task] = {}
+
+
+async def single_flight(
+        key: str,
+        fetch: Callable[[], Awaitable[T]],
+        recheck: Callable[[], Awaitable[T | None]],
+        redis: Redis,
+) -> T:
+    """
+    Выполняет fetch для ключа кеша не больше одного раза одновременно в воркере.
+
+    Остальные вызовы с тем же ключом ждут результат уже запущенного запроса. Если включена
+    блокировка в Redis, запрос выполняется под ней, чтобы защитить Elasticsearch и от других воркеров:
+    получив блокировку, воркер сначала перечитывает кеш через recheck.
+    """
+    task = _flights.get(key)
+    if task is None:
+        if settings.cache_lock_enabled:
+            task = asyncio.create_task(_fetch_with_lock(key, fetch, recheck, redis))
+        else:
+            task = asyncio.create_task(fetch())
+        _flights[key] = task
+        task.add_done_callback(lambda _: _flights.pop(key, None))
+    # shield: отмена одного из ожидающих запросов не должна отменять общий запрос
+    return await asyncio.shield(task)
+
+
+async def _fetch_with_lock(
+        key: str,
+        fetch: Callable[[], Awaitable[T]],
+        recheck: Callable[[], Awaitable[T | None]],
+        redis: Redis,
+) -> T:
+    lock = redis.lock(f'lock: {key}', timeout=settings.cache_lock_timeout,
+                      blocking_timeout=settings.cache_lock_timeout)
+    if not await lock.acquire():
+        logger.warning(f'Could not acquire cache lock for {key}, fetching without it')
+        return await fetch()
+    try:
+        cached = await recheck()
+        if cached:
+            return cached
+        return await fetch()
+    finally:
+        try:
+            await lock.release()
+        except LockError:
+            # блокировка истекла раньше, чем закончился запрос
+            pass
@@ -0,0 +1,36 @@
+from redis.asyncio import Redis
+
+
+def get_tag_key(index: str, doc_id: str) -> str:
+    """Множество ключей кеша со списками, в которые попал документ индекса."""
+    return f'tags: {index}: {doc_id}'
+
+
+async def set_tagged(redis: Redis, key: str, data: bytes, expire: int | None, tags: dict[str, list[str]]) -> None:
+    """
+    Кладёт в кеш список и запоминает ключ в тегах документов, из которых он собран.
+
+    :param tags: id документов списка по индексам.
+    """
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.set(key, data, expire)
+        for index, ids in tags.items():
+            for doc_id in ids:
+                tag_key = get_tag_key(index, doc_id)
+                pipe.sadd(tag_key, key)
+                if expire:
+                    # у всех списков одного сервиса один срок жизни, поэтому тег живёт не меньше своих списков
+                    pipe.expire(tag_key, expire)
+        await pipe.execute()
+
+
+async def invalidate_tags(redis: Redis, index: str, ids: list[str], keys: list[str]) -> None:
+    """Удаляет ключи документов и все списки, в которые эти документы попали."""
+    tag_keys = [get_tag_key(index, doc_id) for doc_id in ids]
+    async with redis.pipeline(transaction=False) as pipe:
+        for tag_key in tag_keys:
+            pipe.smembers(tag_key)
+        tagged = await pipe.execute()
+    stale = set(keys).union(tag_keys, *({key.decode() for key in members} for members in tagged))
+    if stale:
+        await redis.delete(*stale)
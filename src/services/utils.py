@@ -1,6 +1,40 @@
 import json
+import types
+import typing
+from functools import lru_cache
+
+from pydantic import BaseModel
 
 
 async def get_key_by_args(*args, **kwargs) -> str:
     """Get key by args and kwargs."""
     return f'{args}:{json.dumps({"kwargs": kwargs}, sort_keys=True)}'
+
+
+@lru_cache()
+def get_source_includes(model: type[BaseModel]) -> list[str]:
+    """
+    Get the _source fields Elasticsearch has to return to build the model.
+
+    Nested models are expanded to dotted paths, so unused fields of nested objects are not fetched either.
+    """
+    includes = []
+    for name, field in model.model_fields.items():
+        key = field.alias or name
+        nested = _get_nested_model(field.annotation)
+        if nested:
+            includes.extend(f'{key}.{path}' for path in get_source_includes(nested))
+        else:
+            includes.append(key)
+    return includes
+
+
+def _get_nested_model(annotation) -> type[BaseModel] | None:
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return annotation
+    if typing.get_origin(annotation) in (list, typing.Union, types.UnionType):
+        for arg in typing.get_args(annotation):
+            nested = _get_nested_model(arg)
+            if nested:
+                return nested
+    return None